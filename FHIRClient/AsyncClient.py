@@ -0,0 +1,407 @@
+# Import httpx module
+import httpx
+
+# Import asyncio module
+import asyncio
+
+# Import getenv and getpid functions
+from os import getenv, getpid
+
+# Import urljoin and urlsplit functions
+from urllib.parse import urljoin, urlsplit
+
+# Import WeakKeyDictionary class
+from weakref import WeakKeyDictionary
+
+# Import perf_counter function
+from time import perf_counter
+
+# Import resource_cache instance
+from FHIRClient.ResourceCache import resource_cache
+
+# Import observe_fhir_response function and coalesced request counter
+from Monitoring.Metrics import observe_fhir_response, fhir_coalesced_requests_total
+
+# Import upstream timeouts, retries and circuit breakers
+from Upstream.CircuitBreaker import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_GET_RETRIES,
+    UpstreamUnavailableError,
+    CircuitOpenError,
+    get_circuit_breaker,
+    retry_delay,
+    retryable_status_codes,
+)
+
+# Default connection pool size of each shared FHIR server client
+DEFAULT_POOL_SIZE = int(getenv('FHIR_ASYNC_CLIENT_POOL_SIZE', '100'))
+
+# Keep-alive clients shared by every AsyncClient, grouped by event loop because connections are bound to it
+shared_clients = WeakKeyDictionary()
+
+# Resource types whose identical in-flight GETs share a single upstream call, such as Organization,Immunization
+FHIR_SINGLE_FLIGHT_TYPES = frozenset(
+    resource_type.strip() for resource_type in getenv('FHIR_SINGLE_FLIGHT_TYPES', '').split(',') if resource_type.strip() != ''
+)
+
+# Upstream GETs currently in flight, grouped by event loop because their futures are bound to it
+in_flight_requests = WeakKeyDictionary()
+
+# Seconds until the response headers arrived, measured by send and reported by status_code_handler
+response_durations = WeakKeyDictionary()
+
+
+def get_shared_client(fhir_server, fhir_token=None, pool_size=None):
+    if pool_size is None:
+        pool_size = DEFAULT_POOL_SIZE
+
+    loop_clients = shared_clients.setdefault(asyncio.get_running_loop(), {})
+    client_key = (getpid(), fhir_server, fhir_token)
+    client = loop_clients.get(client_key)
+    if client is None:
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        timeout = httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+        client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        loop_clients[client_key] = client
+
+    return client
+
+
+async def close_shared_clients():
+    loop_clients = shared_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.aclose()
+
+
+class AsyncClient:
+    def __init__(self, fhir_server, auth=False, fhir_token=None, pool_size=None):
+        self.fhir_server = fhir_server
+        self.content_type_header = 'application/fhir+json'
+        self.accept_header = 'application/fhir+json'
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/94.0.4606.54 Safari/537.36',
+        }
+        if auth is True:
+            if fhir_token is None:
+                raise ValueError('fhir_token param should not be empty!')
+            self.headers['Authorization'] = 'Bearer ' + fhir_token
+        # Requests build on immutable header sets so that one client can be shared by concurrent routes
+        self.read_headers = dict(self.headers, Accept=self.accept_header)
+        self.write_headers = dict(self.read_headers, **{'Content-Type': self.content_type_header})
+        self.client_key = (fhir_server, fhir_token if auth is True else None, pool_size)
+        self.batch_support = None
+
+    @property
+    def client(self):
+        return get_shared_client(*self.client_key)
+
+    async def upload_patient_resource(self, json_payload, stream=False):
+        fhir_server = self.fhir_server + '/Patient'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_patient_resource')
+
+        return response
+
+    async def get_patient_resource_by_id(self, patient_id, stream=False):
+        if resource_cache.enabled('Patient'):
+            return await self.get_cached_resource('Patient', patient_id, 'get_patient_resource_by_id')
+
+        path = '/Patient/' + patient_id
+        fhir_server = self.fhir_server + path
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_patient_resource_by_id')
+
+        return response
+
+    async def get_patient_resource_by_search(self, search_param, stream=False):
+        query_path = '/Patient?' + search_param
+        fhir_server = self.fhir_server + query_path
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_patient_resource_by_search')
+
+        return response
+
+    async def update_patient_resource(self, json_payload, patient_id, stream=False):
+        fhir_server = self.fhir_server + '/Patient/' + patient_id
+        response = await self.send('PUT', fhir_server, self.write_headers, json_payload, stream=stream)
+        # Dropped once the upstream write has finished, so that a read racing with it cannot keep the old version
+        resource_cache.invalidate(self.get_cache_key('Patient', patient_id))
+        self.status_code_handler(response, 'update_patient_resource')
+
+        return response
+
+    async def delete_patient_resource_by_id(self, patient_id, stream=False):
+        fhir_server = self.fhir_server + '/Patient/' + patient_id
+        response = await self.send('DELETE', fhir_server, self.read_headers, stream=stream)
+        # Dropped once the upstream write has finished, so that a read racing with it cannot keep the old version
+        resource_cache.invalidate(self.get_cache_key('Patient', patient_id))
+        self.status_code_handler(response, 'delete_patient_resource_by_id')
+
+        return response
+
+    async def get_patient_lists(self, stream=False, count=None):
+        fhir_server = self.fhir_server + '/Patient'
+        if count is not None:
+            fhir_server += '?_count=' + str(count)
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_patient_lists')
+
+        return response
+
+    async def get_bundle_page(self, page_url, stream=False):
+        # Paging links come from the upstream Bundle, so the token is only ever sent back to the same server
+        fhir_server = urljoin(self.fhir_server + '/', page_url)
+        if urlsplit(fhir_server)[0:2] != urlsplit(self.fhir_server)[0:2]:
+            raise ValueError('Bundle page link should be on the FHIR server: ' + page_url)
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_bundle_page')
+
+        return response
+
+    async def upload_organization_resource(self, json_payload, stream=False):
+        fhir_server = self.fhir_server + '/Organization'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_organization_resource')
+
+        return response
+
+    async def get_organization_resource_by_id(self, organization_id, stream=False):
+        if resource_cache.enabled('Organization'):
+            return await self.get_cached_resource('Organization', organization_id, 'get_organization_resource_by_id')
+
+        fhir_server = self.fhir_server + '/Organization/' + organization_id
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_organization_resource_by_id')
+
+        return response
+
+    async def upload_immunization_resource(self, json_payload, stream=False):
+        fhir_server = self.fhir_server + '/Immunization'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_immunization_resource')
+
+        return response
+
+    async def get_immunization_resource_by_search(self, search_params, stream=False):
+        fhir_server = self.fhir_server + '/Immunization?' + search_params
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_immunization_resource_by_search')
+
+        return response
+
+    async def get_immunization_resource_by_id(self, immunization_bundle_id, stream=False):
+        fhir_server = self.fhir_server + '/Immunization/' + immunization_bundle_id
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_immunization_resource_by_id')
+
+        return response
+
+    async def get_composition_resource_by_id(self, composition_id, stream=False):
+        if resource_cache.enabled('Composition'):
+            return await self.get_cached_resource('Composition', composition_id, 'get_composition_resource_by_id')
+
+        fhir_server = self.fhir_server + '/Composition/' + composition_id
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_composition_resource_by_id')
+
+        return response
+
+    async def upload_composition_resource(self, json_payload, stream=False):
+        fhir_server = self.fhir_server + '/Composition'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_composition_resource')
+
+        return response
+
+    async def upload_observation_resource(self, json_payload, stream=False):
+        fhir_server = self.fhir_server + '/Observation'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_observation_resource')
+
+        return response
+
+    async def get_observation_resource_by_id(self, observation_id, stream=False):
+        if resource_cache.enabled('Observation'):
+            return await self.get_cached_resource('Observation', observation_id, 'get_observation_resource_by_id')
+
+        fhir_server = self.fhir_server + '/Observation/' + observation_id
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_observation_resource_by_id')
+
+        return response
+
+    async def get_observation_bundle_resource_by_id(self, observation_bundle_id, stream=False):
+        if resource_cache.enabled('Bundle'):
+            return await self.get_cached_resource('Bundle', observation_bundle_id, 'get_observation_bundle_resource_by_id')
+
+        fhir_server = self.fhir_server + '/Bundle/' + observation_bundle_id
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_observation_bundle_resource_by_id')
+
+        return response
+
+    async def upload_bundle_resource(self, json_payload, bundle_name, stream=False):
+        fhir_server = self.fhir_server + '/Bundle'
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_bundle_resource(%s)' % bundle_name)
+
+        return response
+
+    async def get_resource_by_reference(self, reference, stream=False):
+        fhir_server = self.fhir_server + '/' + reference
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_resource_by_reference')
+
+        return response
+
+    async def get_capability_statement(self, stream=False):
+        fhir_server = self.fhir_server + '/metadata'
+        response = await self.send('GET', fhir_server, self.read_headers, stream=stream)
+        self.status_code_handler(response, 'get_capability_statement')
+
+        return response
+
+    async def check_batch_support(self):
+        # The CapabilityStatement is only fetched once for each FHIR server setting
+        if self.batch_support is None:
+            batch_support = False
+            try:
+                response = await self.get_capability_statement()
+                if response.status_code == 200:
+                    for rest in response.json().get('rest', []):
+                        for interaction in rest.get('interaction', []):
+                            if interaction.get('code') == 'batch':
+                                batch_support = True
+            except (httpx.HTTPError, ValueError):
+                batch_support = False
+            except UpstreamUnavailableError:
+                # Not remembered, the CapabilityStatement is fetched again once the FHIR server is reachable
+                return False
+            self.batch_support = batch_support
+
+        return self.batch_support
+
+    async def upload_transaction_bundle(self, json_payload, bundle_type='transaction', stream=False):
+        # transaction and batch Bundles are processed by the FHIR server base endpoint
+        fhir_server = self.fhir_server
+        response = await self.send('POST', fhir_server, self.write_headers, json_payload, stream=stream)
+        self.status_code_handler(response, 'upload_transaction_bundle(%s)' % bundle_type)
+
+        return response
+
+    def get_cache_key(self, resource_type, resource_id):
+        return self.client_key[:2] + (resource_type, resource_id)
+
+    async def get_cached_resource(self, resource_type, resource_id, method_name):
+        # Cached reads are always fully read responses, a passthrough route forwards their bytes as they are
+        cache_key = self.get_cache_key(resource_type, resource_id)
+        entry, fresh = resource_cache.lookup(cache_key)
+        if fresh is True:
+            return entry['response']
+
+        headers = self.read_headers
+        if entry is not None:
+            headers = dict(headers, **entry['validators'])
+        fhir_server = self.fhir_server + '/' + resource_type + '/' + resource_id
+        response = await self.send('GET', fhir_server, headers)
+        # A 304 answer is an upstream call like any other one
+        self.status_code_handler(response, method_name)
+        if response.status_code == 304 and entry is not None:
+            resource_cache.revalidated(cache_key, entry)
+            return entry['response']
+
+        if response.status_code == 200:
+            resource_cache.store(cache_key, response)
+        else:
+            resource_cache.invalidate(cache_key)
+
+        return response
+
+    def get_resource_type(self, fhir_server):
+        if fhir_server.startswith(self.fhir_server + '/') is False:
+            return None
+
+        return fhir_server[len(self.fhir_server) + 1:].split('?', 1)[0].split('/', 1)[0]
+
+    async def send(self, method, fhir_server, headers, content=None, stream=False):
+        resource_type = self.get_resource_type(fhir_server)
+        if method == 'GET' and resource_type in FHIR_SINGLE_FLIGHT_TYPES:
+            # A streamed body can only be read once, so coalesced responses are always fully read
+            return await self.send_coalesced(resource_type, fhir_server, headers)
+
+        return await self.send_upstream(method, fhir_server, headers, content, stream)
+
+    async def send_coalesced(self, resource_type, fhir_server, headers):
+        # The token is part of client_key and the headers carry the cache validators, only identical requests share a call
+        loop = asyncio.get_running_loop()
+        loop_requests = in_flight_requests.setdefault(loop, {})
+        request_key = self.client_key[:2] + (fhir_server, tuple(sorted(headers.items())))
+        in_flight = loop_requests.get(request_key)
+        if in_flight is not None:
+            fhir_coalesced_requests_total.labels(resource_type).inc()
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # Only the waiter itself was cancelled, or the first caller was and this one asks the upstream on its own
+                if in_flight.cancelled() is False:
+                    raise
+                return await self.send_upstream('GET', fhir_server, headers)
+
+        in_flight = loop.create_future()
+        loop_requests[request_key] = in_flight
+        try:
+            response = await self.send_upstream('GET', fhir_server, headers)
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except BaseException as e:
+            in_flight.set_exception(e)
+            # Retrieved here so that a failed call without waiters is not logged as never retrieved
+            in_flight.exception()
+            raise
+        else:
+            in_flight.set_result(response)
+        finally:
+            # Nothing outlives the call, a request arriving after it finished goes to the upstream again
+            del loop_requests[request_key]
+
+        return response
+
+    async def send_upstream(self, method, fhir_server, headers, content=None, stream=False):
+        # Only idempotent GETs are retried, every attempt has to pass the circuit breaker of the FHIR server
+        circuit_breaker = get_circuit_breaker(fhir_server)
+        attempts = 1 + UPSTREAM_GET_RETRIES if method == 'GET' else 1
+        for attempt in range(attempts):
+            if circuit_breaker.allow_request() is False:
+                raise CircuitOpenError(circuit_breaker)
+
+            # Streamed responses are left unread so that their bytes can be forwarded to the caller as they arrive
+            request = self.client.build_request(method, fhir_server, headers=headers, content=content)
+            started_at = perf_counter()
+            try:
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                circuit_breaker.record_failure()
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(retry_delay(attempt))
+                    continue
+                raise UpstreamUnavailableError(circuit_breaker.upstream, type(e).__name__) from e
+
+            if response.status_code not in retryable_status_codes:
+                circuit_breaker.record_success()
+            else:
+                circuit_breaker.record_failure()
+                if attempt + 1 < attempts:
+                    await response.aclose()
+                    await asyncio.sleep(retry_delay(attempt))
+                    continue
+            response_durations[response] = perf_counter() - started_at
+
+            return response
+
+    def status_code_handler(self, response, method_name):
+        # Callers sharing a coalesced response find it already reported by the first one
+        if response not in response_durations:
+            return
+        observe_fhir_response(method_name, response.status_code, response_durations.pop(response))
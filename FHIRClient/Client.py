@@ -1,9 +1,81 @@
 # Import requests module
 import requests
 
+# Import HTTPAdapter class
+from requests.adapters import HTTPAdapter
+
+# Import Retry class
+from urllib3.util.retry import Retry
+
+# Import getenv and getpid functions
+from os import getenv, getpid
+
+# Import Lock class
+from threading import Lock
+
+# Import observe_fhir_response function
+from Monitoring.Metrics import observe_fhir_response
+
+# Import upstream timeouts, retries and circuit breakers
+from Upstream.CircuitBreaker import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_GET_RETRIES,
+    UPSTREAM_RETRY_BACKOFF,
+    UpstreamUnavailableError,
+    CircuitOpenError,
+    get_circuit_breaker,
+    retryable_status_codes,
+)
+
+# Default connection pool size of each shared FHIR server session
+DEFAULT_POOL_SIZE = int(getenv('FHIR_CLIENT_POOL_SIZE', '10'))
+
+# Keep-alive sessions shared by every Client in this worker process
+shared_sessions = {}
+shared_sessions_lock = Lock()
+
+
+def get_shared_session(fhir_server, fhir_token=None, pool_size=None):
+    if pool_size is None:
+        pool_size = DEFAULT_POOL_SIZE
+
+    # The worker pid is a part of the key because sockets must not be shared across forked workers
+    session_key = (getpid(), fhir_server, fhir_token)
+    session = shared_sessions.get(session_key)
+    if session is not None:
+        return session
+
+    with shared_sessions_lock:
+        session = shared_sessions.get(session_key)
+        if session is None:
+            session = requests.Session()
+            # Only idempotent GETs are retried, backoff_jitter needs urllib3 2
+            retry = Retry(
+                total=UPSTREAM_GET_RETRIES,
+                allowed_methods=frozenset(['GET']),
+                status_forcelist=retryable_status_codes,
+                backoff_factor=UPSTREAM_RETRY_BACKOFF,
+                backoff_jitter=UPSTREAM_RETRY_BACKOFF,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            shared_sessions[session_key] = session
+
+    return session
+
+
+def close_shared_sessions():
+    with shared_sessions_lock:
+        for session in shared_sessions.values():
+            session.close()
+        shared_sessions.clear()
+
 
 class Client:
-    def __init__(self, fhir_server, auth=False, fhir_token=None):
+    def __init__(self, fhir_server, auth=False, fhir_token=None, pool_size=None):
         self.fhir_server = fhir_server
         self.content_type_header = 'application/fhir+json'
         self.accept_header = 'application/fhir+json'
@@ -14,12 +86,13 @@ class Client:
             if fhir_token is None:
                 raise ValueError('fhir_token param should not be empty!')
             self.headers['Authorization'] = 'Bearer ' + fhir_token
+        self.session = get_shared_session(fhir_server, fhir_token if auth is True else None, pool_size)
 
     def upload_patient_resource(self, json_payload):
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Patient'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_patient_resource')
 
         return response
@@ -28,7 +101,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         path = '/Patient/' + patient_id
         fhir_server = self.fhir_server + path
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_patient_resource_by_id')
 
         return response
@@ -37,7 +110,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         query_path = '/Patient?' + search_param
         fhir_server = self.fhir_server + query_path
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_patient_resource_by_search')
 
         return response
@@ -46,7 +119,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Patient/' + patient_id
-        response = requests.put(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('PUT', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'update_patient_resource')
 
         return response
@@ -54,7 +127,7 @@ class Client:
     def delete_patient_resource_by_id(self, patient_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Patient/' + patient_id
-        response = requests.delete(fhir_server, headers=self.headers)
+        response = self.send('DELETE', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'delete_patient_resource_by_id')
 
         return response
@@ -62,7 +135,7 @@ class Client:
     def get_patient_lists(self):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Patient'
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_patient_lists')
 
         return response
@@ -71,7 +144,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Organization'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_organization_resource')
 
         return response
@@ -79,7 +152,7 @@ class Client:
     def get_organization_resource_by_id(self, organization_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Organization/' + organization_id
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_organization_resource_by_id')
 
         return response
@@ -88,7 +161,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Immunization'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_immunization_resource')
 
         return response
@@ -96,7 +169,7 @@ class Client:
     def get_immunization_resource_by_search(self, search_params):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Immunization?' + search_params
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_immunization_resource_by_search')
 
         return response
@@ -104,7 +177,7 @@ class Client:
     def get_immunization_resource_by_id(self, immunization_bundle_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Immunization/' + immunization_bundle_id
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_immunization_resource_by_id')
 
         return response
@@ -112,7 +185,7 @@ class Client:
     def get_composition_resource_by_id(self, composition_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Composition/' + composition_id
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_composition_resource_by_id')
 
         return response
@@ -121,7 +194,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Composition'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_composition_resource')
 
         return response
@@ -130,7 +203,7 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Observation'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_observation_resource')
 
         return response
@@ -138,7 +211,7 @@ class Client:
     def get_observation_resource_by_id(self, observation_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Observation/' + observation_id
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_observation_resource_by_id')
 
         return response
@@ -146,7 +219,7 @@ class Client:
     def get_observation_bundle_resource_by_id(self, observation_bundle_id):
         self.headers['Accept'] = self.accept_header
         fhir_server = self.fhir_server + '/Bundle/' + observation_bundle_id
-        response = requests.get(fhir_server, headers=self.headers)
+        response = self.send('GET', fhir_server, headers=self.headers)
         self.status_code_handler(response, 'get_observation_bundle_resource_by_id')
 
         return response
@@ -155,12 +228,28 @@ class Client:
         self.headers['Accept'] = self.accept_header
         self.headers['Content-Type'] = self.content_type_header
         fhir_server = self.fhir_server + '/Bundle'
-        response = requests.post(fhir_server, headers=self.headers, data=json_payload)
+        response = self.send('POST', fhir_server, headers=self.headers, data=json_payload)
         self.status_code_handler(response, 'upload_bundle_resource(%s)' % bundle_name)
 
         return response
 
+    def send(self, method, fhir_server, **kwargs):
+        circuit_breaker = get_circuit_breaker(fhir_server)
+        if circuit_breaker.allow_request() is False:
+            raise CircuitOpenError(circuit_breaker)
+
+        try:
+            response = self.session.request(method, fhir_server, timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT), **kwargs)
+        except requests.RequestException as e:
+            circuit_breaker.record_failure()
+            raise UpstreamUnavailableError(circuit_breaker.upstream, type(e).__name__) from e
+
+        if response.status_code in retryable_status_codes:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+
+        return response
+
     def status_code_handler(self, response, method_name):
-        if response.status_code != 200 and response.status_code != 201:
-            print('Error response when doing ' + method_name + ': ')
-            print(response.text)
+        observe_fhir_response(method_name, response.status_code, response.elapsed.total_seconds())
@@ -0,0 +1,162 @@
+# Import OrderedDict class
+from collections import OrderedDict
+
+# Import datetime and timezone classes
+from datetime import datetime, timezone
+
+# Import format_datetime function
+from email.utils import format_datetime
+
+# Import loads function
+from json import loads
+
+# Import getenv function
+from os import getenv
+
+# Import Lock class
+from threading import Lock
+
+# Import monotonic function
+from time import monotonic
+
+# Maximum number of resources kept by each worker process
+FHIR_RESOURCE_CACHE_SIZE = int(getenv('FHIR_RESOURCE_CACHE_SIZE', '1024'))
+
+# Seconds a cached resource is served before it is revalidated, 0 disables the cache
+FHIR_RESOURCE_CACHE_TTL = float(getenv('FHIR_RESOURCE_CACHE_TTL', '30'))
+
+# Per resource type TTL overrides, such as Organization=3600,Patient=10
+FHIR_RESOURCE_CACHE_TTLS = getenv('FHIR_RESOURCE_CACHE_TTLS', 'Organization=3600')
+
+# Resource types written through this server, another worker may have changed them so every hit is revalidated
+FHIR_RESOURCE_CACHE_REVALIDATE_TYPES = frozenset(
+    resource_type.strip() for resource_type in getenv('FHIR_RESOURCE_CACHE_REVALIDATE_TYPES', 'Patient').split(',') if resource_type.strip() != ''
+)
+
+
+def parse_resource_ttls(ttl_setting):
+    resource_ttls = {}
+    for ttl_item in ttl_setting.split(','):
+        if '=' not in ttl_item:
+            continue
+        resource_type, ttl = ttl_item.split('=', 1)
+        resource_ttls[resource_type.strip()] = float(ttl)
+
+    return resource_ttls
+
+
+class ResourceCache:
+    def __init__(self, max_size, default_ttl, resource_ttls, revalidate_types):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.resource_ttls = resource_ttls
+        self.revalidate_types = revalidate_types
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def enabled(self, resource_type):
+        return self.max_size > 0 and self.resource_ttls.get(resource_type, self.default_ttl) > 0
+
+    def lookup(self, cache_key):
+        # Returns the cached entry and whether it is still fresh
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+
+            self.entries.move_to_end(cache_key)
+            # Other resource types are only as stale as their TTL, the invalidation of a write only reaches this worker
+            if cache_key[-2] not in self.revalidate_types and monotonic() < entry['expires_at']:
+                self.hits += 1
+                return entry, True
+
+            # Stale entries are revalidated, the ones still unchanged upstream are also counted as revalidations
+            self.stale += 1
+            return entry, False
+
+    def store(self, cache_key, response):
+        resource_type = cache_key[-2]
+        entry = {
+            'response': response,
+            'validators': self.get_validators(response),
+            'expires_at': monotonic() + self.resource_ttls.get(resource_type, self.default_ttl),
+        }
+        with self.lock:
+            self.entries[cache_key] = entry
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def revalidated(self, cache_key, entry):
+        # A 304 Not Modified answer keeps the cached response for another TTL period
+        resource_type = cache_key[-2]
+        with self.lock:
+            entry['expires_at'] = monotonic() + self.resource_ttls.get(resource_type, self.default_ttl)
+            self.revalidations += 1
+
+    def invalidate(self, cache_key):
+        with self.lock:
+            if self.entries.pop(cache_key, None) is not None:
+                self.invalidations += 1
+
+    def get_validators(self, response):
+        validators = {}
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if etag is None or last_modified is None:
+            # Fall back to the resource meta only when the upstream server sends no validator headers
+            try:
+                meta = loads(response.content).get('meta', {})
+            except (ValueError, AttributeError):
+                meta = {}
+            if etag is None and 'versionId' in meta:
+                etag = 'W/"' + str(meta['versionId']) + '"'
+            if last_modified is None and 'lastUpdated' in meta:
+                last_modified = to_http_date(meta['lastUpdated'])
+
+        if etag is not None:
+            validators['If-None-Match'] = etag
+        if last_modified is not None:
+            validators['If-Modified-Since'] = last_modified
+
+        return validators
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+            }
+
+
+def to_http_date(fhir_instant):
+    try:
+        updated_time = datetime.fromisoformat(str(fhir_instant).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if updated_time.tzinfo is None:
+        updated_time = updated_time.replace(tzinfo=timezone.utc)
+
+    return format_datetime(updated_time.astimezone(timezone.utc), usegmt=True)
+
+
+resource_cache = ResourceCache(
+    FHIR_RESOURCE_CACHE_SIZE,
+    FHIR_RESOURCE_CACHE_TTL,
+    parse_resource_ttls(FHIR_RESOURCE_CACHE_TTLS),
+    FHIR_RESOURCE_CACHE_REVALIDATE_TYPES,
+)
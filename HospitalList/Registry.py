@@ -0,0 +1,129 @@
+# Import csv module
+import csv
+
+# Import namedtuple function
+from collections import namedtuple
+
+# Import dumps function
+from json import dumps
+
+# Import sha256 module
+from hashlib import sha256
+
+# Import Lock class
+from threading import Lock
+
+# One row of the hospital list CSV file, in the same column order
+Hospital = namedtuple('Hospital', [
+    'hospital_number',
+    'hospital_name',
+    'facility_type',
+    'phone',
+    'address',
+    'branch',
+    'contract_type',
+    'service_items',
+    'departments',
+    'contract_end_date',
+    'clinic_hours',
+    'note',
+    'county_code',
+])
+
+# Searchable columns, the multi-valued ones list their items separated by 、
+single_valued_fields = ['county_code', 'contract_type', 'facility_type']
+multi_valued_fields = ['service_items', 'departments']
+
+
+class HospitalRegistry:
+    def __init__(self, hospitals):
+        self.hospitals = tuple(hospitals)
+
+        # The list response never changes after loading, so it is serialized and hashed only once
+        response_json = {
+            'hospital_name': [hospital.hospital_name for hospital in self.hospitals],
+            'hospital_number': [hospital.hospital_number for hospital in self.hospitals],
+        }
+        self.hospital_lists_body = dumps(response_json, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.hospital_lists_etag = '"' + sha256(self.hospital_lists_body).hexdigest() + '"'
+
+        # Inverted indexes map every field value to the frozenset of matching row positions
+        self.indexes = {}
+        for field_name in single_valued_fields + multi_valued_fields:
+            index = {}
+            for position, hospital in enumerate(self.hospitals):
+                for value in self.field_values(hospital, field_name):
+                    index.setdefault(value, set()).add(position)
+            self.indexes[field_name] = {value: frozenset(positions) for value, positions in index.items()}
+
+    def field_values(self, hospital, field_name):
+        field_value = getattr(hospital, field_name).strip()
+        if field_name in multi_valued_fields:
+            return [item.strip() for item in field_value.split('、') if item.strip() != '']
+        if field_value == '':
+            return []
+
+        return [field_value]
+
+    def search(self, filters, match_all=True, offset=0, limit=20):
+        # Fields are AND-ed, values of a single-valued field are OR-ed and multi-valued fields follow match_all
+        candidate_sets = []
+        for field_name, values in filters.items():
+            if len(values) == 0:
+                continue
+            index = self.indexes[field_name]
+            value_sets = [index.get(value, frozenset()) for value in values]
+            if field_name in multi_valued_fields and match_all is True:
+                candidate_sets.extend(value_sets)
+            else:
+                candidate_sets.append(frozenset().union(*value_sets))
+
+        if len(candidate_sets) == 0:
+            positions = range(len(self.hospitals))
+        else:
+            # Intersecting from the smallest set keeps every step bounded by the rarest value
+            candidate_sets.sort(key=len)
+            matched = set(candidate_sets[0])
+            for candidate_set in candidate_sets[1:]:
+                if len(matched) == 0:
+                    break
+                matched.intersection_update(candidate_set)
+            positions = sorted(matched)
+
+        hospitals = [self.hospitals[position] for position in positions[offset:offset + limit]]
+
+        return len(positions), hospitals
+
+    def etag_matches(self, if_none_match):
+        if if_none_match is None:
+            return False
+
+        for etag in if_none_match.split(','):
+            etag = etag.strip()
+            if etag == '*' or etag == self.hospital_lists_etag or etag == 'W/' + self.hospital_lists_etag:
+                return True
+
+        return False
+
+
+def load_hospital_registry(csv_path):
+    with open(csv_path, 'r', encoding='utf-8', newline='') as file_handler:
+        csv_reader = csv.reader(file_handler)
+        next(csv_reader)
+        hospitals = [Hospital(*row) for row in csv_reader if len(row) == len(Hospital._fields)]
+
+    return HospitalRegistry(hospitals)
+
+
+hospital_registry = None
+hospital_registry_lock = Lock()
+
+
+def get_hospital_registry(csv_path='./hospital.csv'):
+    global hospital_registry
+    if hospital_registry is None:
+        with hospital_registry_lock:
+            if hospital_registry is None:
+                hospital_registry = load_hospital_registry(csv_path)
+
+    return hospital_registry
@@ -0,0 +1,160 @@
+# Import prometheus_client metric classes and exposition helpers
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+# Import Match enum
+from starlette.routing import Match
+
+# Import wraps decorator
+from functools import wraps
+
+# Import iscoroutinefunction function
+from inspect import iscoroutinefunction
+
+# Import getenv function
+from os import getenv
+
+# Import perf_counter function
+from time import perf_counter
+
+# Gunicorn workers write their samples to this directory so that any worker can expose the sum of all of them
+PROMETHEUS_MULTIPROC_DIR = getenv('PROMETHEUS_MULTIPROC_DIR')
+
+http_request_duration_seconds = Histogram(
+    'http_request_duration_seconds',
+    'Time spent serving a request, until its last body chunk is sent.',
+    ['method', 'route', 'status'],
+)
+http_requests_in_flight = Gauge(
+    'http_requests_in_flight',
+    'Requests currently being served.',
+    ['method', 'route'],
+    multiprocess_mode='livesum',
+)
+fhir_upstream_duration_seconds = Histogram(
+    'fhir_upstream_duration_seconds',
+    'Time until the FHIR server answered with its response headers.',
+    ['client_method'],
+)
+fhir_upstream_responses_total = Counter(
+    'fhir_upstream_responses_total',
+    'FHIR server responses by client method and status code.',
+    ['client_method', 'status'],
+)
+fhir_coalesced_requests_total = Counter(
+    'fhir_coalesced_requests_total',
+    'FHIR GETs that shared the response of an identical request already in flight.',
+    ['resource_type'],
+)
+twca_portal_duration_seconds = Histogram(
+    'twca_portal_duration_seconds',
+    'Time spent calling the TWCA IDPortal.',
+    ['client_method'],
+)
+sqlite_helper_duration_seconds = Histogram(
+    'sqlite_helper_duration_seconds',
+    'Time spent in each SQLite storage helper.',
+    ['helper'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+upstream_circuit_state = Gauge(
+    'upstream_circuit_state',
+    'Circuit breaker state of each upstream server, 0 closed, 1 half-open and 2 open, the worst worker wins.',
+    ['upstream'],
+    multiprocess_mode='max',
+)
+qr_code_image_duration_seconds = Histogram(
+    'qr_code_image_duration_seconds',
+    'Time spent producing a QR code image, including cache lookups and rendering.',
+    ['image_format'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+def timed(histogram, label):
+    def decorator(function):
+        if iscoroutinefunction(function):
+            # Coroutines are timed until they finished, not until they were created
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                started_at = perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    histogram.labels(label).observe(perf_counter() - started_at)
+
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started_at = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.labels(label).observe(perf_counter() - started_at)
+
+        return wrapper
+
+    return decorator
+
+
+def observe_fhir_response(client_method, status_code, seconds):
+    fhir_upstream_responses_total.labels(client_method, str(status_code)).inc()
+    if seconds is not None:
+        fhir_upstream_duration_seconds.labels(client_method).observe(seconds)
+
+
+def generate_metrics():
+    if PROMETHEUS_MULTIPROC_DIR is None:
+        return generate_latest(REGISTRY)
+
+    # A fresh registry per scrape reads every worker's sample files, including the ones of exited workers
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+
+    return generate_latest(registry)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def get_route_path(self, scope):
+        # Routes are labelled by their template so that path parameters do not create new series
+        for route in scope['app'].router.routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, 'path', scope['path'])
+
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        route_path = self.get_route_path(scope)
+        response_status = {'status': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response_status['status'] = message['status']
+            await send(message)
+
+        in_flight = http_requests_in_flight.labels(method, route_path)
+        in_flight.inc()
+        started_at = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            http_request_duration_seconds.labels(method, route_path, str(response_status['status'])).observe(perf_counter() - started_at)
+
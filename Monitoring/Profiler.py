@@ -0,0 +1,294 @@
+# Import sys module
+import sys
+
+# Import Context and ContextVar classes
+from contextvars import Context, ContextVar
+
+# Import compare_digest function
+from hmac import compare_digest
+
+# Import dumps and loads functions
+from json import dumps, loads
+
+# Import getenv, getpid, listdir, makedirs and remove functions
+from os import getenv, getpid, listdir, makedirs, remove
+
+# Import os.path functions
+from os.path import abspath, dirname, join
+
+# Import random function
+from random import random
+
+# Import fullmatch function
+from re import fullmatch
+
+# Import gettempdir function
+from tempfile import gettempdir
+
+# Import Event, Lock and Thread classes and get_ident function
+from threading import Event, Lock, Thread, get_ident
+
+# Import perf_counter and time functions
+from time import perf_counter, time
+
+# Import token_hex function
+from secrets import token_hex
+
+# Requests carrying this value in the X-Profile header are profiled, unset disables the header and the downloads
+PROFILE_ADMIN_TOKEN = getenv('PROFILE_ADMIN_TOKEN')
+
+# Fraction of requests profiled without the header, 0 disables sampling
+PROFILE_SAMPLE_RATE = float(getenv('PROFILE_SAMPLE_RATE', '0'))
+
+# Milliseconds between two stack samples of a profiled request
+PROFILE_INTERVAL_MS = float(getenv('PROFILE_INTERVAL_MS', '5'))
+
+# Directory and number of profiles kept on disk, the oldest ones are deleted first
+PROFILE_DIR = getenv('PROFILE_DIR', join(gettempdir(), 'hospital_system_server_profiles'))
+PROFILE_RING_SIZE = int(getenv('PROFILE_RING_SIZE', '50'))
+
+# Frames of the application itself, the stacks of idle threads never reach them
+project_root = dirname(dirname(abspath(__file__)))
+profiler_file = abspath(__file__)
+
+profile_ring_lock = Lock()
+
+# Sampler of the request being handled, copied into the thread pool together with the context of a sync route
+profiled_request = ContextVar('profiled_request', default=None)
+
+
+def profiling_enabled():
+    return PROFILE_ADMIN_TOKEN is not None or PROFILE_SAMPLE_RATE > 0
+
+
+def is_admin_token(token):
+    if PROFILE_ADMIN_TOKEN is None or token is None:
+        return False
+
+    return compare_digest(token.encode('utf-8'), PROFILE_ADMIN_TOKEN.encode('utf-8'))
+
+
+def is_application_frame(frame):
+    filename = frame.f_code.co_filename
+    return filename.startswith(project_root) and 'site-packages' not in filename and filename != profiler_file
+
+
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(project_root):
+        filename = filename[len(project_root) + 1:]
+
+    return '%s (%s:%d)' % (code.co_name, filename, code.co_firstlineno)
+
+
+def find_frame(frame, matches):
+    while frame is not None:
+        if matches(frame):
+            return frame
+        frame = frame.f_back
+
+    return None
+
+
+def find_context(frame):
+    # The thread pool worker keeps the copied request context as a local variable below the endpoint frame
+    while frame is not None:
+        for value in frame.f_locals.values():
+            if isinstance(value, Context):
+                return value
+        frame = frame.f_back
+
+    return None
+
+
+class StackSampler:
+    def __init__(self, profile_id, scope, request_frame):
+        self.profile_id = profile_id
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.request_frame = request_frame
+        self.loop_ident = get_ident()
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name='profile-' + profile_id, daemon=True)
+
+    def start(self):
+        self.started_at = time()
+        self.started_counter = perf_counter()
+        self.thread.start()
+
+    def stop(self, status_code):
+        self.status_code = status_code
+        self.duration = perf_counter() - self.started_counter
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+        save_profile(self)
+
+    def sample(self):
+        # Other requests and background workers share the event loop and the thread pool, so only the stacks of this request count
+        current_frames = sys._current_frames()
+        loop_frame = current_frames.get(self.loop_ident)
+        if loop_frame is not None and find_frame(loop_frame, lambda frame: frame is self.request_frame) is not None:
+            self.record(loop_frame)
+
+        # A sync route runs its endpoint in a thread pool thread carrying a copy of the request context
+        endpoint_code = getattr(self.scope.get('endpoint'), '__code__', None)
+        if endpoint_code is None:
+            return
+        for thread_ident, frame in current_frames.items():
+            if thread_ident == self.loop_ident:
+                continue
+            endpoint_frame = find_frame(frame, lambda frame: frame.f_code is endpoint_code)
+            if endpoint_frame is None:
+                continue
+            context = find_context(endpoint_frame.f_back)
+            if context is not None and context.get(profiled_request) is self:
+                self.record(frame)
+
+    def record(self, frame):
+        labels = []
+        in_application = False
+        while frame is not None:
+            if in_application is False and is_application_frame(frame):
+                in_application = True
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        if in_application is False:
+            return
+        stack = ';'.join(reversed(labels))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def to_dict(self):
+        return {
+            'profile_id': self.profile_id,
+            'method': self.method,
+            'path': self.path,
+            'status_code': self.status_code,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': self.stacks,
+        }
+
+
+def save_profile(sampler):
+    with profile_ring_lock:
+        makedirs(PROFILE_DIR, exist_ok=True)
+        with open(join(PROFILE_DIR, sampler.profile_id + '.json'), 'w', encoding='utf-8') as file_handler:
+            file_handler.write(dumps(sampler.to_dict()))
+
+        # Profile ids start with their creation time, so the sorted names are oldest first
+        profile_files = sorted(file_name for file_name in listdir(PROFILE_DIR) if file_name.endswith('.json'))
+        for file_name in profile_files[:max(len(profile_files) - PROFILE_RING_SIZE, 0)]:
+            try:
+                remove(join(PROFILE_DIR, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    profiles = []
+    with profile_ring_lock:
+        makedirs(PROFILE_DIR, exist_ok=True)
+        for file_name in sorted(listdir(PROFILE_DIR), reverse=True):
+            if file_name.endswith('.json') is False:
+                continue
+            profile = load_profile(file_name[:-len('.json')])
+            if profile is None:
+                continue
+            del profile['stacks']
+            profiles.append(profile)
+
+    return profiles
+
+
+def load_profile(profile_id):
+    if fullmatch(r'[0-9]{13}-[0-9]+-[0-9a-f]{8}', profile_id) is None:
+        return None
+
+    try:
+        with open(join(PROFILE_DIR, profile_id + '.json'), 'r', encoding='utf-8') as file_handler:
+            return loads(file_handler.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def to_collapsed_stacks(profile):
+    # Folded stack lines read by flamegraph.pl, inferno and speedscope
+    return ''.join('%s %d\n' % (stack, count) for stack, count in profile['stacks'].items())
+
+
+def to_speedscope(profile):
+    frames = []
+    frame_indexes = {}
+    samples = []
+    weights = []
+    for stack, count in profile['stacks'].items():
+        sample = []
+        for label in stack.split(';'):
+            if label not in frame_indexes:
+                frame_indexes[label] = len(frames)
+                frames.append({'name': label})
+            sample.append(frame_indexes[label])
+        samples.append(sample)
+        weights.append(count * profile['interval'])
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': '%s %s' % (profile['method'], profile['path']),
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': profile['profile_id'],
+        'exporter': 'hospital-system-server',
+    }
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def should_profile(self, scope):
+        for header_name, header_value in scope['headers']:
+            if header_name == b'x-profile':
+                return is_admin_token(header_value.decode('latin-1'))
+
+        return PROFILE_SAMPLE_RATE > 0 and random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self.should_profile(scope) is False:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = '%013d-%d-%s' % (int(time() * 1000), getpid(), token_hex(4))
+        sampler = StackSampler(profile_id, scope, sys._getframe())
+        response_status = {'status': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response_status['status'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', profile_id.encode('latin-1'))]
+            await send(message)
+
+        sampler.start()
+        profiled_request_token = profiled_request.set(sampler)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiled_request.reset(profiled_request_token)
+            sampler.stop(response_status['status'])
@@ -0,0 +1,172 @@
+# Import qrcode module
+import qrcode
+
+# Import SvgPathImage class
+from qrcode.image.svg import SvgPathImage
+
+# Import ByteIO function
+from io import BytesIO
+
+# Import OrderedDict class
+from collections import OrderedDict
+
+# Import ProcessPoolExecutor class and BrokenProcessPool exception
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Import get_context function
+from multiprocessing import get_context
+
+# Import getenv and getpid functions
+from os import getenv, getpid
+
+# Import Lock class
+from threading import Lock
+
+# Maximum number of rendered images kept by each worker process, keyed by validation URL and image options
+QR_CODE_CACHE_SIZE = int(getenv('QR_CODE_CACHE_SIZE', '1024'))
+
+# Number of processes rendering cache misses, 0 renders them in the request thread
+QR_CODE_RENDER_PROCESSES = int(getenv('QR_CODE_RENDER_PROCESSES', '2'))
+
+
+# QR code error correction levels by their letter
+error_correction_levels = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+# Media types of the supported image formats
+image_media_types = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def render_qr_code_image(validation_url, image_format='png', box_size=10, border=4, error_correction='M'):
+    qr_code = qrcode.QRCode(box_size=box_size, border=border, error_correction=error_correction_levels[error_correction])
+    qr_code.add_data(validation_url)
+    qr_code.make(fit=True)
+    output_binary = BytesIO()
+    if image_format == 'svg':
+        # SVG paths are written without PIL and are much smaller than the PNG bitmap
+        qr_code.make_image(image_factory=SvgPathImage).save(output_binary)
+    else:
+        qr_code.make_image().save(output_binary, format='PNG')
+
+    return output_binary.getvalue()
+
+
+class QRCodeCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.images = OrderedDict()
+        self.token_keys = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cache_key):
+        with self.lock:
+            cached = self.images.get(cache_key)
+            if cached is None:
+                self.misses += 1
+                return None
+
+            self.images.move_to_end(cache_key)
+            self.hits += 1
+
+            return cached[1]
+
+    def put(self, cache_key, token, image):
+        with self.lock:
+            if cache_key in self.images:
+                self.images.move_to_end(cache_key)
+                return
+
+            self.images[cache_key] = (token, image)
+            self.token_keys.setdefault(token, set()).add(cache_key)
+            while len(self.images) > self.max_size:
+                evicted_key, evicted = self.images.popitem(last=False)
+                self.forget_token_key(evicted[0], evicted_key)
+                self.evictions += 1
+
+    def evict_token(self, token):
+        # A rotated token never validates again, so every image rendered for it is dropped at once
+        with self.lock:
+            for cache_key in self.token_keys.pop(token, set()):
+                if self.images.pop(cache_key, None) is not None:
+                    self.evictions += 1
+
+    def forget_token_key(self, token, cache_key):
+        token_keys = self.token_keys.get(token)
+        if token_keys is None:
+            return
+        token_keys.discard(cache_key)
+        if len(token_keys) == 0:
+            del self.token_keys[token]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.images),
+                'max_size': self.max_size,
+            }
+
+
+qr_code_cache = QRCodeCache(QR_CODE_CACHE_SIZE)
+
+render_pool = {
+    'pid': None,
+    'executor': None,
+}
+render_pool_lock = Lock()
+
+
+def get_render_executor():
+    if QR_CODE_RENDER_PROCESSES <= 0:
+        return None
+
+    with render_pool_lock:
+        if render_pool['pid'] != getpid():
+            # Spawned renderers do not inherit the threads and sockets of the forked web worker
+            render_pool['executor'] = ProcessPoolExecutor(max_workers=QR_CODE_RENDER_PROCESSES, mp_context=get_context('spawn'))
+            render_pool['pid'] = getpid()
+
+        return render_pool['executor']
+
+
+def shutdown_render_executor():
+    with render_pool_lock:
+        if render_pool['executor'] is not None and render_pool['pid'] == getpid():
+            render_pool['executor'].shutdown(wait=False, cancel_futures=True)
+        render_pool['executor'] = None
+        render_pool['pid'] = None
+
+
+def render_image(image_options):
+    executor = get_render_executor()
+    if executor is None:
+        return render_qr_code_image(*image_options)
+
+    try:
+        return executor.submit(render_qr_code_image, *image_options).result()
+    except BrokenProcessPool:
+        shutdown_render_executor()
+        return render_qr_code_image(*image_options)
+
+
+def get_qr_code_image(validation_url, token, image_format='png', box_size=10, border=4, error_correction='M'):
+    image_options = (validation_url, image_format, box_size, border, error_correction)
+    image = qr_code_cache.get(image_options)
+    if image is None:
+        image = render_image(image_options)
+        qr_code_cache.put(image_options, token, image)
+
+    return image
@@ -0,0 +1,744 @@
+# Import sqlite3 module
+import sqlite3
+
+# Import contextmanager decorator
+from contextlib import contextmanager
+
+# Import datetime and timedelta classes
+from datetime import datetime, timedelta
+
+# Import dumps and loads functions
+from json import dumps, loads
+
+# Import getenv and getpid functions
+from os import getenv, getpid
+
+# Import token_hex function
+from secrets import token_hex
+
+# Import gettempdir module
+from tempfile import gettempdir
+
+# Import RLock class
+from threading import RLock
+
+# Import sleep and time functions
+from time import sleep, time
+
+# Import SQLite helper timing histogram
+from Monitoring.Metrics import timed, sqlite_helper_duration_seconds
+
+# Import passport_token_store instance
+from Storage.TokenStore import passport_token_store
+
+# Milliseconds a connection waits for another worker's write lock before raising database is locked
+BUSY_TIMEOUT_MS = int(getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# Seconds TWID verify records are kept, 0 keeps them forever
+TWID_VERIFY_RETENTION_SECONDS = int(getenv('TWID_VERIFY_RETENTION_SECONDS', '2592000'))
+
+# Rows deleted by one retention transaction, so that the write lock is only held briefly
+RETENTION_BATCH_SIZE = int(getenv('RETENTION_BATCH_SIZE', '500'))
+
+# Seconds a worker owns a pending VerifyResult callback without renewing it, afterwards any worker may take it over
+TWCA_VERIFY_LEASE_SECONDS = int(getenv('TWCA_VERIFY_LEASE_SECONDS', '60'))
+
+# Seconds between two retention batches and pages freed by one incremental vacuum step
+RETENTION_BATCH_PAUSE = 0.01
+INCREMENTAL_VACUUM_PAGES = 500
+
+
+class Database:
+    def __init__(self, path, migrations):
+        self.path = path
+        self.migrations = migrations
+        self.lock = RLock()
+        self.pid = None
+        self.conn = None
+
+    def connection(self):
+        # Connections are opened once per worker process and never shared across a fork
+        if self.pid != getpid():
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+            conn.execute('PRAGMA busy_timeout = %d' % BUSY_TIMEOUT_MS)
+            # Only applies to new database files, existing ones are converted by python -m Storage.Maintenance
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self.migrate(conn)
+            self.conn = conn
+            self.pid = getpid()
+
+        return self.conn
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            conn = self.connection()
+            with conn:
+                yield conn
+
+    def migrate(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS "schema_migrations"(
+                [Version] NVARCHAR(100) PRIMARY KEY NOT NULL,
+                [AppliedDateTime] NVARCHAR(50) NOT NULL
+            )
+        ''')
+        conn.commit()
+
+        for version, statements in self.migrations:
+            if conn.execute('SELECT 1 FROM schema_migrations WHERE Version = ?', [version]).fetchone() is not None:
+                continue
+
+            # BEGIN IMMEDIATE serializes workers booting at the same time, so re-check after taking the lock
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM schema_migrations WHERE Version = ?', [version]).fetchone() is None:
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(
+                        'INSERT INTO schema_migrations(Version, AppliedDateTime) VALUES (?, ?)',
+                        [version, datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def data_version(self):
+        # Changes whenever another connection, including other workers, commits to the database
+        with self.lock:
+            return self.connection().execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == getpid():
+                self.conn.close()
+            self.conn = None
+            self.pid = None
+
+
+hospital_db = Database(gettempdir() + '/hospital_system_server.sqlite3', [
+    ('hospital_0001_create_vaccine_register', [
+        '''
+        CREATE TABLE IF NOT EXISTS "vaccine_register"(
+            [RegisterId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            [VaccinePersonName] NVARCHAR(100) NOT NULL,
+            [VaccinePersonFirstName] NVARCHAR(100) NULL,
+            [VaccinePersonLastName] NVARCHAR(100) NULL,
+            [CountryName] NVARCHAR(100) NULL,
+            [IdentityNumber] NVARCHAR(100) NOT NULL,
+            [DoseListId] NVARCHAR(100) NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS "vaccine_dose_lists"(
+            [ListId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            [DoseManufactureName] NVARCHAR(50) NOT NULL,
+            [DoseNumber] INT NOT NULL,
+            [VaccineDate] NVARCHAR(50) NOT NULL,
+            [DoseListId] NVARCHAR(100) NOT NULL,
+            CONSTRAINT fk_dose_list_id
+                FOREIGN KEY (DoseListId)
+                REFERENCES vaccine_register(DoseListId)
+        )
+        ''',
+    ]),
+    ('hospital_0002_create_fhir_server', [
+        '''
+        CREATE TABLE IF NOT EXISTS "fhir_server"(
+            [ServerId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            [Server] NVARCHAR(100) NOT NULL,
+            [Token] NVARCHAR(100) NULL
+        )
+        ''',
+    ]),
+    ('hospital_0003_create_vaccine_register_indexes', [
+        # Merge duplicated registrations of one identity number into the earliest one before enforcing uniqueness
+        '''
+        UPDATE vaccine_dose_lists SET DoseListId = (
+            SELECT first_register.DoseListId FROM vaccine_register AS first_register
+            WHERE first_register.IdentityNumber = (
+                SELECT IdentityNumber FROM vaccine_register WHERE DoseListId = vaccine_dose_lists.DoseListId
+            )
+            ORDER BY first_register.RegisterId LIMIT 1
+        )
+        WHERE DoseListId IN (
+            SELECT DoseListId FROM vaccine_register WHERE RegisterId NOT IN (
+                SELECT MIN(RegisterId) FROM vaccine_register GROUP BY IdentityNumber
+            )
+        )
+        ''',
+        '''
+        DELETE FROM vaccine_register WHERE RegisterId NOT IN (
+            SELECT MIN(RegisterId) FROM vaccine_register GROUP BY IdentityNumber
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "vaccine_register_identity_number" ON vaccine_register(IdentityNumber)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "vaccine_register_dose_list_id" ON vaccine_register(DoseListId)',
+        'CREATE INDEX IF NOT EXISTS "vaccine_dose_lists_dose_list_id" ON vaccine_dose_lists(DoseListId)',
+    ]),
+])
+
+passport_db = Database(gettempdir() + '/healthy_passport.sqlite3', [
+    ('passport_0001_create_passport_token', [
+        '''
+        CREATE TABLE IF NOT EXISTS "passport_token"(
+            [PassportId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            [DoseNumberPositiveInt] TINYINT NOT NULL,
+            [lastOccurrenceDate] NVARCHAR(15) NOT NULL,
+            [hashedIdentifierNumber] NVARCHAR(150) NOT NULL,
+            [createdTokenDateTime] INT NOT NULL,
+            [Token] NVARCHAR(200) NULL
+        )
+        ''',
+    ]),
+    ('passport_0002_create_passport_token_indexes', [
+        # Only the latest token of each hashed identifier number is active
+        '''
+        DELETE FROM passport_token WHERE PassportId NOT IN (
+            SELECT MAX(PassportId) FROM passport_token GROUP BY hashedIdentifierNumber
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "passport_token_hashed_identifier_number" ON passport_token(hashedIdentifierNumber)',
+        'CREATE INDEX IF NOT EXISTS "passport_token_token" ON passport_token(Token)',
+    ]),
+    ('passport_0003_create_passport_token_created_index', [
+        'CREATE INDEX IF NOT EXISTS "passport_token_created_token_date_time" ON passport_token(createdTokenDateTime)',
+    ]),
+    # Passport tokens are no longer pruned, so nothing reads this index any more
+    ('passport_0004_drop_passport_token_created_index', [
+        'DROP INDEX IF EXISTS "passport_token_created_token_date_time"',
+    ]),
+])
+
+twid_db = Database(getenv('TWID_DATABASE_PATH', '/var/tmp/healthy_passport.sqlite3'), [
+    ('twid_0001_create_twid_verify_no', [
+        '''
+        CREATE TABLE IF NOT EXISTS "twid_verify_no"(
+            [ListId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            [VerifyNo] NVARCHAR(70) NOT NULL,
+            [MemberNo] NVARCHAR(70) NOT NULL,
+            [LoginToken] NVARCHAR(100) NOT NULL,
+            [IdentifyNoWithToken] NVARCHAR(150) NOT NULL,
+            [CreatedDateTime] NVARCHAR(50) NOT NULL,
+            [LoginResultCode] NVARCHAR(5) NOT NULL,
+            [LoginReturnCode] NVARCHAR(10) NOT NULL,
+            [LoginTime] NVARCHAR(70) NOT NULL,
+            [DoResultCode] NVARCHAR(5) NULL,
+            [DoReturnCode] NVARCHAR(10) NULL,
+            [QueryResultCode] NVARCHAR(5) NULL,
+            [QueryReturnCode] NVARCHAR(10) NULL,
+            [QueryTime] NVARCHAR(70) NULL
+        )
+        ''',
+    ]),
+    ('twid_0002_create_twid_verify_no_indexes', [
+        # Login tokens are issued by the TWID Portal, so they are indexed without a uniqueness guarantee
+        'CREATE INDEX IF NOT EXISTS "twid_verify_no_login_token" ON twid_verify_no(LoginToken)',
+    ]),
+    ('twid_0003_create_twid_verify_no_created_index', [
+        'CREATE INDEX IF NOT EXISTS "twid_verify_no_created_date_time" ON twid_verify_no(CreatedDateTime)',
+    ]),
+    ('twid_0004_add_twid_verify_no_callback_columns', [
+        'ALTER TABLE twid_verify_no ADD COLUMN [CallbackForm] TEXT NULL',
+        'ALTER TABLE twid_verify_no ADD COLUMN [QueryStatus] NVARCHAR(20) NULL',
+        'ALTER TABLE twid_verify_no ADD COLUMN [QueryAttempts] INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE twid_verify_no ADD COLUMN [QueryError] NVARCHAR(200) NULL',
+        'ALTER TABLE twid_verify_no ADD COLUMN [QueryClaim] NVARCHAR(50) NULL',
+        # Only the few callbacks still waiting for their QueryVerifyResult follow-up are indexed
+        'CREATE INDEX IF NOT EXISTS "twid_verify_no_pending_query" ON twid_verify_no(QueryClaim) WHERE QueryStatus = \'pending\'',
+    ]),
+    ('twid_0005_add_twid_verify_no_claimed_at', [
+        'ALTER TABLE twid_verify_no ADD COLUMN [QueryClaimedAt] INTEGER NULL',
+        # Callbacks claimed by the earlier run id scheme are left with an expired lease
+        'UPDATE twid_verify_no SET QueryClaimedAt = 0 WHERE QueryStatus = \'pending\'',
+        'CREATE INDEX IF NOT EXISTS "twid_verify_no_pending_claimed_at" ON twid_verify_no(QueryClaimedAt) WHERE QueryStatus = \'pending\'',
+    ]),
+])
+
+databases = [hospital_db, passport_db, twid_db]
+
+
+def open_databases():
+    for database in databases:
+        with database.transaction():
+            pass
+
+    return True
+
+
+def close_databases():
+    for database in databases:
+        database.close()
+
+    return True
+
+
+# Statements filtering on lookup columns, each one must be served by an index
+DELETE_PASSPORT_TOKEN_SQL = '''
+    DELETE FROM passport_token WHERE hashedIdentifierNumber = ?
+'''
+
+QUERY_FHIR_SERVER_SQL = '''
+    SELECT Server,Token FROM fhir_server ORDER BY ServerId DESC LIMIT 1
+'''
+
+QUERY_VACCINE_REGISTERS_SQL = '''
+    SELECT IdentityNumber, DoseListId FROM vaccine_register WHERE
+    IdentityNumber IN (SELECT value FROM json_each(?))
+'''
+
+QUERY_LATEST_PASSPORT_ID_SQL = '''
+    SELECT COALESCE(MAX(PassportId), 0) FROM passport_token
+'''
+
+QUERY_ROTATED_PASSPORT_TOKENS_SQL = '''
+    SELECT PassportId, hashedIdentifierNumber, Token FROM passport_token WHERE PassportId > ? ORDER BY PassportId
+'''
+
+QUERY_PASSPORT_TOKEN_BY_TOKEN_SQL = '''
+    SELECT
+        DoseNumberPositiveInt,
+        lastOccurrenceDate,
+        hashedIdentifierNumber,
+        createdTokenDateTime,
+        Token
+    FROM passport_token WHERE Token=? ORDER BY PassportId DESC LIMIT 1
+'''
+
+QUERY_PASSPORT_TOKEN_BY_HASHED_IDENTIFIER_SQL = '''
+    SELECT
+        DoseNumberPositiveInt,
+        lastOccurrenceDate,
+        hashedIdentifierNumber,
+        createdTokenDateTime,
+        Token
+    FROM passport_token WHERE hashedIdentifierNumber=? ORDER BY PassportId DESC LIMIT 1
+'''
+
+PRUNE_TWID_VERIFY_NO_SQL = '''
+    DELETE FROM twid_verify_no WHERE ListId IN (
+        SELECT ListId FROM twid_verify_no WHERE CreatedDateTime < ? LIMIT ?
+    )
+'''
+
+UPDATE_DO_VERIFY_NO_SQL = '''
+    UPDATE twid_verify_no
+    SET DoReturnCode = ?, DoResultCode = ?
+    WHERE LoginToken = ?
+'''
+
+UPDATE_QUERY_VERIFY_NO_SQL = '''
+    UPDATE twid_verify_no
+    SET QueryReturnCode = ?, QueryResultCode = ?, QueryTime= ?, QueryAttempts = ?, QueryStatus = 'completed', QueryError = NULL
+    WHERE LoginToken = ?
+'''
+
+STORE_VERIFY_CALLBACK_SQL = '''
+    UPDATE twid_verify_no
+    SET DoReturnCode = ?, DoResultCode = ?, CallbackForm = ?, QueryStatus = 'pending', QueryAttempts = 0, QueryError = NULL, QueryClaim = ?, QueryClaimedAt = ?
+    WHERE LoginToken = ?
+'''
+
+UPDATE_QUERY_VERIFY_ERROR_SQL = '''
+    UPDATE twid_verify_no
+    SET QueryAttempts = COALESCE(?, QueryAttempts), QueryStatus = ?, QueryError = ?
+    WHERE LoginToken = ?
+'''
+
+RENEW_VERIFY_CALLBACK_LEASES_SQL = '''
+    UPDATE twid_verify_no SET QueryClaimedAt = ?
+    WHERE QueryStatus = 'pending' AND QueryClaim = ?
+'''
+
+QUERY_EXPIRED_VERIFY_CALLBACKS_SQL = '''
+    SELECT ListId, QueryClaimedAt, LoginToken, MemberNo, CallbackForm FROM twid_verify_no
+    WHERE QueryStatus = 'pending' AND QueryClaimedAt < ? LIMIT ?
+'''
+
+CLAIM_VERIFY_CALLBACK_SQL = '''
+    UPDATE twid_verify_no SET QueryClaim = ?, QueryClaimedAt = ?
+    WHERE ListId = ? AND QueryStatus = 'pending' AND QueryClaimedAt = ?
+'''
+
+QUERY_VERIFY_OUTCOME_SQL = '''
+    SELECT
+        VerifyNo,
+        MemberNo,
+        DoReturnCode,
+        DoResultCode,
+        QueryStatus,
+        QueryAttempts,
+        QueryReturnCode,
+        QueryResultCode,
+        QueryTime,
+        QueryError
+    FROM twid_verify_no WHERE LoginToken = ? ORDER BY ListId DESC LIMIT 1
+'''
+
+QUERY_MEMBER_NO_SQL = '''
+    SELECT MemberNo FROM twid_verify_no
+    WHERE LoginToken = ?
+'''
+
+# The fhir_server table holds a single row, so its reverse rowid scan is not listed here
+lookup_queries = [
+    (passport_db, DELETE_PASSPORT_TOKEN_SQL),
+    (hospital_db, QUERY_VACCINE_REGISTERS_SQL),
+    (passport_db, QUERY_PASSPORT_TOKEN_BY_TOKEN_SQL),
+    (passport_db, QUERY_LATEST_PASSPORT_ID_SQL),
+    (passport_db, QUERY_ROTATED_PASSPORT_TOKENS_SQL),
+    (passport_db, QUERY_PASSPORT_TOKEN_BY_HASHED_IDENTIFIER_SQL),
+    (twid_db, UPDATE_DO_VERIFY_NO_SQL),
+    (twid_db, UPDATE_QUERY_VERIFY_NO_SQL),
+    (twid_db, QUERY_MEMBER_NO_SQL),
+    (twid_db, STORE_VERIFY_CALLBACK_SQL),
+    (twid_db, UPDATE_QUERY_VERIFY_ERROR_SQL),
+    (twid_db, RENEW_VERIFY_CALLBACK_LEASES_SQL),
+    (twid_db, QUERY_EXPIRED_VERIFY_CALLBACKS_SQL),
+    (twid_db, CLAIM_VERIFY_CALLBACK_SQL),
+    (twid_db, QUERY_VERIFY_OUTCOME_SQL),
+    (twid_db, PRUNE_TWID_VERIFY_NO_SQL),
+]
+
+
+def explain_query_plans():
+    scanned_queries = []
+    for database, sql in lookup_queries:
+        with database.transaction() as db_conn:
+            query_plan = db_conn.execute('EXPLAIN QUERY PLAN ' + sql, [None] * sql.count('?')).fetchall()
+
+        for plan_row in query_plan:
+            # Scanning the json_each virtual table only walks the bound parameter list
+            detail = plan_row[-1]
+            if detail.startswith('SCAN') and 'USING INDEX' not in detail and 'USING COVERING INDEX' not in detail and 'VIRTUAL TABLE' not in detail:
+                scanned_queries.append((' '.join(sql.split()), detail))
+
+    return scanned_queries
+
+
+@timed(sqlite_helper_duration_seconds, 'store_fhir_passport_token')
+def store_fhir_passport_token(record):
+    sync_passport_token_store()
+    with passport_db.transaction() as db_conn:
+        db_conn.execute(DELETE_PASSPORT_TOKEN_SQL, [record[2]])
+        db_conn.execute(
+            '''
+            INSERT INTO passport_token
+            (
+                DoseNumberPositiveInt,
+                lastOccurrenceDate,
+                hashedIdentifierNumber,
+                createdTokenDateTime,
+                Token
+            )
+            VALUES (?, ?, ?, ?, ?)
+            ''',
+            record
+        )
+    passport_token_store.put(record)
+
+    return True
+
+
+def sync_passport_token_store():
+    # PRAGMA data_version only changes after a commit of another worker, then the rows stored since the last sync are read
+    # through the PassportId primary key, AUTOINCREMENT gives every stored token a larger one
+    with passport_db.lock:
+        db_conn = passport_db.connection()
+        data_version = db_conn.execute('PRAGMA data_version').fetchone()[0]
+        # data_version values are only comparable on one connection, a reopened one syncs again
+        if (db_conn, data_version) == passport_token_store.synced_data_version:
+            return
+        if passport_token_store.synced_passport_id is None:
+            passport_token_store.synced_passport_id = db_conn.execute(QUERY_LATEST_PASSPORT_ID_SQL).fetchone()[0]
+        else:
+            stored_tokens = db_conn.execute(QUERY_ROTATED_PASSPORT_TOKENS_SQL, [passport_token_store.synced_passport_id]).fetchall()
+            passport_token_store.forget_rotated([(hashed_identifier_number, token) for _, hashed_identifier_number, token in stored_tokens])
+            if len(stored_tokens) > 0:
+                passport_token_store.synced_passport_id = stored_tokens[-1][0]
+        passport_token_store.synced_data_version = (db_conn, data_version)
+
+
+@timed(sqlite_helper_duration_seconds, 'store_fhir_server_setting')
+def store_fhir_server_setting(fhir_server, fhir_token=None):
+    with hospital_db.transaction() as db_conn:
+        db_conn.execute('DELETE FROM fhir_server')
+
+        if fhir_token is None:
+            db_conn.execute('INSERT INTO fhir_server(Server) VALUES (?)', [fhir_server])
+        else:
+            db_conn.execute('INSERT INTO fhir_server(Server, Token) VALUES (?, ?)', [fhir_server, fhir_token])
+
+    return True
+
+
+@timed(sqlite_helper_duration_seconds, 'query_fhir_server_setting')
+def query_fhir_server_setting():
+    with hospital_db.transaction() as db_conn:
+        fetched_result = db_conn.execute(QUERY_FHIR_SERVER_SQL).fetchone()
+
+    if fetched_result is None:
+        return False
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'store_vaccine_registers')
+def store_vaccine_registers(vaccine_registers):
+    # Every register is a (user_info, dose_records) pair, user_info carries a fresh DoseListId in its last column
+    with hospital_db.transaction() as db_conn:
+        db_conn.executemany('''
+            INSERT INTO vaccine_register(
+                VaccinePersonName,
+                VaccinePersonFirstName,
+                VaccinePersonLastName,
+                CountryName,
+                IdentityNumber,
+                DoseListId
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(IdentityNumber) DO NOTHING
+        ''', [user_info for user_info, dose_records in vaccine_registers])
+
+        # Registered identities keep their existing DoseListId, resolved for the whole batch at once
+        identity_numbers = dumps([user_info[4] for user_info, dose_records in vaccine_registers])
+        dose_list_ids = dict(db_conn.execute(QUERY_VACCINE_REGISTERS_SQL, [identity_numbers]).fetchall())
+
+        vaccine_records = []
+        for user_info, dose_records in vaccine_registers:
+            dose_list_id = dose_list_ids[user_info[4]]
+            for dose_record in dose_records:
+                vaccine_records.append(list(dose_record) + [dose_list_id])
+
+        db_conn.executemany('''
+            INSERT INTO vaccine_dose_lists(
+                DoseManufactureName, DoseNumber, VaccineDate, DoseListId
+            ) VALUES (?, ?, ?, ?)
+        ''', vaccine_records)
+
+    return True
+
+
+@timed(sqlite_helper_duration_seconds, 'query_database_by_token')
+def query_database_by_token(token):
+    with passport_db.transaction() as db_conn:
+        fetched_result = db_conn.execute(QUERY_PASSPORT_TOKEN_BY_TOKEN_SQL, [token]).fetchone()
+
+    if fetched_result is None:
+        return False
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'query_passport_token')
+def query_passport_token(token):
+    # Tokens rotated by other workers are dropped from memory first, every other stored token is answered from memory
+    sync_passport_token_store()
+    stored_record = passport_token_store.get(token)
+    if stored_record is not None:
+        return stored_record
+
+    fetched_result = query_database_by_token(token)
+    if fetched_result is not False:
+        passport_token_store.put(fetched_result)
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'query_database_by_hashed_identified_number')
+def query_database_by_hashed_identified_number(hashed_identifier_number):
+    with passport_db.transaction() as db_conn:
+        fetched_result = db_conn.execute(QUERY_PASSPORT_TOKEN_BY_HASHED_IDENTIFIER_SQL, [hashed_identifier_number]).fetchone()
+
+    if fetched_result is None:
+        return False
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'update_do_verify_no')
+def update_do_verify_no(login_token, do_return_code, do_result_code):
+    with twid_db.transaction() as db_conn:
+        db_conn.execute(UPDATE_DO_VERIFY_NO_SQL, [do_return_code, do_result_code, login_token])
+
+    return True
+
+
+@timed(sqlite_helper_duration_seconds, 'update_query_verify_no')
+def update_query_verify_no(login_token, query_return_code, query_result_code, query_time, query_attempts=1):
+    with twid_db.transaction() as db_conn:
+        db_conn.execute(UPDATE_QUERY_VERIFY_NO_SQL, [query_return_code, query_result_code, query_time, query_attempts, login_token])
+
+    return True
+
+
+# Owner of the VerifyResult callbacks queued by this worker process
+verify_worker = {
+    'pid': None,
+    'id': None,
+}
+
+
+def get_verify_worker_id():
+    # A random part keeps a restarted worker that reuses a pid from taking its predecessor's leases for its own
+    if verify_worker['pid'] != getpid():
+        verify_worker['pid'] = getpid()
+        verify_worker['id'] = '%d-%s' % (getpid(), token_hex(4))
+
+    return verify_worker['id']
+
+
+@timed(sqlite_helper_duration_seconds, 'store_verify_callback')
+def store_verify_callback(login_token, do_return_code, do_result_code, callback_form):
+    # The callback form and its pending follow-up are written at once, so the portal can be acknowledged right after
+    with twid_db.transaction() as db_conn:
+        updated = db_conn.execute(STORE_VERIFY_CALLBACK_SQL, [
+            do_return_code,
+            do_result_code,
+            dumps(callback_form),
+            get_verify_worker_id(),
+            int(time()),
+            login_token,
+        ]).rowcount
+        if updated == 0:
+            return False
+        fetched_result = db_conn.execute(QUERY_MEMBER_NO_SQL, [login_token]).fetchone()
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'update_query_verify_error')
+def update_query_verify_error(login_token, query_attempts, query_status, query_error):
+    # None keeps the attempts already recorded, for errors raised outside of an attempt
+    with twid_db.transaction() as db_conn:
+        db_conn.execute(UPDATE_QUERY_VERIFY_ERROR_SQL, [query_attempts, query_status, query_error[:200], login_token])
+
+    return True
+
+
+@timed(sqlite_helper_duration_seconds, 'renew_verify_callback_leases')
+def renew_verify_callback_leases():
+    # One heartbeat renews every callback this worker still has queued or in flight
+    with twid_db.transaction() as db_conn:
+        renewed = db_conn.execute(RENEW_VERIFY_CALLBACK_LEASES_SQL, [int(time()), get_verify_worker_id()]).rowcount
+
+    return renewed
+
+
+@timed(sqlite_helper_duration_seconds, 'claim_expired_verify_callbacks')
+def claim_expired_verify_callbacks(batch_size=100):
+    # Each claim only succeeds while the lease is still the expired one that was read, so one worker wins every callback
+    claimed_at = int(time())
+    claimed_callbacks = []
+    with twid_db.transaction() as db_conn:
+        fetched_results = db_conn.execute(QUERY_EXPIRED_VERIFY_CALLBACKS_SQL, [claimed_at - TWCA_VERIFY_LEASE_SECONDS, batch_size]).fetchall()
+        for list_id, expired_claimed_at, login_token, member_no, callback_form in fetched_results:
+            claimed = db_conn.execute(CLAIM_VERIFY_CALLBACK_SQL, [get_verify_worker_id(), claimed_at, list_id, expired_claimed_at]).rowcount
+            if claimed == 1:
+                claimed_callbacks.append((login_token, member_no, loads(callback_form)))
+
+    return claimed_callbacks
+
+
+@timed(sqlite_helper_duration_seconds, 'query_verify_outcome')
+def query_verify_outcome(login_token):
+    with twid_db.transaction() as db_conn:
+        fetched_result = db_conn.execute(QUERY_VERIFY_OUTCOME_SQL, [login_token]).fetchone()
+
+    if fetched_result is None:
+        return False
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'query_member_no_by_token')
+def query_member_no_by_token(token):
+    with twid_db.transaction() as db_conn:
+        fetched_result = db_conn.execute(QUERY_MEMBER_NO_SQL, [token]).fetchone()
+
+    if fetched_result is None:
+        return False
+
+    return fetched_result
+
+
+@timed(sqlite_helper_duration_seconds, 'store_verify_no')
+def store_verify_no(verify_no, identify_no, login_token, member_no, login_result_code, login_return_code, login_time):
+    created_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with twid_db.transaction() as db_conn:
+        db_conn.execute('''
+            INSERT INTO twid_verify_no(
+                VerifyNo,
+                MemberNo,
+                LoginToken,
+                IdentifyNoWithToken,
+                CreatedDateTime,
+                LoginResultCode,
+                LoginReturnCode,
+                LoginTime
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            verify_no,
+            member_no,
+            login_token,
+            identify_no,
+            created_time,
+            login_result_code,
+            login_return_code,
+            login_time
+        ])
+
+    return True
+
+
+def prune_records(database, prune_sql, cutoff, batch_size):
+    pruned = 0
+    while True:
+        with database.transaction() as db_conn:
+            deleted = db_conn.execute(prune_sql, [cutoff, batch_size]).rowcount
+        pruned += deleted
+        if deleted < batch_size:
+            return pruned
+        sleep(RETENTION_BATCH_PAUSE)
+
+
+def incremental_vacuum(database):
+    # Free pages are handed back to the file system a few at a time instead of in one long VACUUM
+    while True:
+        with database.transaction() as db_conn:
+            if db_conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return False
+            if db_conn.execute('PRAGMA freelist_count').fetchone()[0] == 0:
+                return True
+            db_conn.execute('PRAGMA incremental_vacuum(%d)' % INCREMENTAL_VACUUM_PAGES).fetchall()
+        sleep(RETENTION_BATCH_PAUSE)
+
+
+@timed(sqlite_helper_duration_seconds, 'prune_expired_records')
+def prune_expired_records(batch_size=None):
+    if batch_size is None:
+        batch_size = RETENTION_BATCH_SIZE
+
+    # Passport tokens are never pruned, the table holds one row per identity that GetDatabaseRecord rotates
+    twid_cutoff = (datetime.now() - timedelta(seconds=TWID_VERIFY_RETENTION_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    retention_tables = [
+        ('twid_verify_no', twid_db, PRUNE_TWID_VERIFY_NO_SQL, twid_cutoff, TWID_VERIFY_RETENTION_SECONDS),
+    ]
+
+    report = {}
+    for table_name, database, prune_sql, cutoff, retention_seconds in retention_tables:
+        pruned = 0
+        if retention_seconds > 0:
+            pruned = prune_records(database, prune_sql, cutoff, batch_size)
+        if pruned > 0:
+            incremental_vacuum(database)
+        with database.transaction() as db_conn:
+            remaining = db_conn.execute('SELECT COUNT(*) FROM ' + table_name).fetchone()[0]
+        report[table_name] = {
+            'pruned': pruned,
+            'remaining': remaining,
+        }
+
+    return report
+
@@ -0,0 +1,21 @@
+# Import databases list
+from Storage.Database import databases
+
+
+def enable_incremental_vacuum(database):
+    # VACUUM rewrites the whole file under an exclusive lock, so it is only run by hand and never by a worker
+    with database.lock:
+        conn = database.connection()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+    return True
+
+
+if __name__ == '__main__':
+    # Run with python -m Storage.Maintenance once to convert database files created before incremental vacuum
+    for database in databases:
+        converted = enable_incremental_vacuum(database)
+        print(database.path + ': ' + ('converted to incremental vacuum' if converted else 'already uses incremental vacuum'))
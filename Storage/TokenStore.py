@@ -0,0 +1,82 @@
+# Import heappush and heappop functions
+from heapq import heappush, heappop
+
+# Import Lock class
+from threading import Lock
+
+# Import time function
+from time import time
+
+# Seconds a passport token stays valid after it is created
+TOKEN_EXPIRY_SECONDS = 180
+
+
+class TokenStore:
+    def __init__(self, expiry_seconds):
+        self.expiry_seconds = expiry_seconds
+        self.records = {}
+        self.identifier_tokens = {}
+        self.expiry_heap = []
+        self.lock = Lock()
+        # Newest passport_token row, connection and data_version already checked for tokens rotated by other workers
+        self.synced_passport_id = None
+        self.synced_data_version = None
+
+    def put(self, record):
+        # Records keep the passport_token column order, createdTokenDateTime and Token are the last two
+        expires_at = int(record[3]) + self.expiry_seconds
+        token = record[4]
+        with self.lock:
+            self.evict_expired()
+            if expires_at < int(time()):
+                return
+
+            # A hashed identifier owns a single token, the rotated one is no longer valid
+            old_token = self.identifier_tokens.get(record[2])
+            if old_token is not None and old_token != token:
+                self.records.pop(old_token, None)
+            self.identifier_tokens[record[2]] = token
+            self.records[token] = (expires_at, tuple(record))
+            heappush(self.expiry_heap, (expires_at, token))
+
+    def get(self, token):
+        with self.lock:
+            self.evict_expired()
+            stored = self.records.get(token)
+            if stored is None:
+                return None
+
+            return stored[1]
+
+    def forget_rotated(self, rotated_tokens):
+        # Only the identifiers whose stored token is no longer their latest one are dropped
+        with self.lock:
+            for hashed_identifier_number, token in rotated_tokens:
+                stored_token = self.identifier_tokens.get(hashed_identifier_number)
+                if stored_token is not None and stored_token != token:
+                    self.discard(stored_token)
+
+    def discard(self, token):
+        stored = self.records.pop(token, None)
+        if stored is not None and self.identifier_tokens.get(stored[1][2]) == token:
+            del self.identifier_tokens[stored[1][2]]
+
+    def evict_expired(self):
+        # Heap entries of replaced tokens are skipped when their own expiry time comes
+        now = int(time())
+        while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] < now:
+            expires_at, token = heappop(self.expiry_heap)
+            stored = self.records.get(token)
+            if stored is None or stored[0] != expires_at:
+                continue
+            del self.records[token]
+            if self.identifier_tokens.get(stored[1][2]) == token:
+                del self.identifier_tokens[stored[1][2]]
+
+    def __len__(self):
+        with self.lock:
+            self.evict_expired()
+            return len(self.records)
+
+
+passport_token_store = TokenStore(TOKEN_EXPIRY_SECONDS)
@@ -1,10 +1,55 @@
-# Import requests module
-import requests
+# Import httpx module
+import httpx
+
+# Import asyncio module
+import asyncio
 
 # Import loads funcion
 from json import loads
 
-from starlette.responses import Response
+# Import getenv and getpid functions
+from os import getenv, getpid
+
+# Import WeakKeyDictionary class
+from weakref import WeakKeyDictionary
+
+# Import TWCA portal timing histogram
+from Monitoring.Metrics import timed, twca_portal_duration_seconds
+
+# Import upstream timeouts and circuit breakers
+from Upstream.CircuitBreaker import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UpstreamUnavailableError,
+    CircuitOpenError,
+    get_circuit_breaker,
+    retryable_status_codes,
+)
+
+# Connection pool size of the IDPortal client of each worker process
+TWCA_CLIENT_POOL_SIZE = int(getenv('TWCA_CLIENT_POOL_SIZE', '20'))
+
+# Keep-alive clients shared by every TWCA Client, grouped by event loop because connections are bound to it
+shared_portal_clients = WeakKeyDictionary()
+
+
+def get_shared_portal_client():
+    loop_clients = shared_portal_clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(getpid())
+    if client is None:
+        limits = httpx.Limits(max_connections=TWCA_CLIENT_POOL_SIZE, max_keepalive_connections=TWCA_CLIENT_POOL_SIZE)
+        timeout = httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+        client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        loop_clients[getpid()] = client
+
+    return client
+
+
+async def close_shared_portal_clients():
+    loop_clients = shared_portal_clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.aclose()
+
 
 class Client:
     def __init__(self, portal_server):
@@ -14,16 +59,41 @@ class Client:
             'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8',
         }
 
-    def login_portal(self, url, payload):
+    @property
+    def client(self):
+        return get_shared_portal_client()
+
+    @timed(twca_portal_duration_seconds, 'login_portal')
+    async def login_portal(self, url, payload):
         url += '/Login'
-        response = requests.post(url, headers=self.headers, data=payload)
+        response = await self.send(url, payload)
 
         response_dict = loads(response.text)
 
         return response_dict
 
-    def query_verified_result(self, payload):
-        response = requests.post(self.portal_server, headers=self.headers, data=payload)
+    @timed(twca_portal_duration_seconds, 'query_verified_result')
+    async def query_verified_result(self, payload):
+        response = await self.send(self.portal_server, payload)
         response_dict = loads(response.text)
 
         return response_dict
+
+    async def send(self, url, payload):
+        # Portal calls are POSTs, so they are never retried here but still fail fast while the portal is unhealthy
+        circuit_breaker = get_circuit_breaker(url)
+        if circuit_breaker.allow_request() is False:
+            raise CircuitOpenError(circuit_breaker)
+
+        try:
+            response = await self.client.post(url, headers=self.headers, data=payload)
+        except httpx.TransportError as e:
+            circuit_breaker.record_failure()
+            raise UpstreamUnavailableError(circuit_breaker.upstream, type(e).__name__) from e
+
+        if response.status_code in retryable_status_codes:
+            circuit_breaker.record_failure()
+            raise UpstreamUnavailableError(circuit_breaker.upstream, 'HTTP %d' % response.status_code)
+        circuit_breaker.record_success()
+
+        return response
@@ -0,0 +1,148 @@
+# Import getenv function
+from os import getenv
+
+# Import random function
+from random import random
+
+# Import Lock class
+from threading import Lock
+
+# Import monotonic function
+from time import monotonic
+
+# Import urlsplit function
+from urllib.parse import urlsplit
+
+# Import upstream circuit state gauge
+from Monitoring.Metrics import upstream_circuit_state
+
+# Seconds allowed to open a connection to an upstream server and to wait for each read from it
+UPSTREAM_CONNECT_TIMEOUT = float(getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_READ_TIMEOUT = float(getenv('UPSTREAM_READ_TIMEOUT', '30'))
+
+# Extra attempts of an idempotent GET and the base seconds of their jittered exponential backoff
+UPSTREAM_GET_RETRIES = int(getenv('UPSTREAM_GET_RETRIES', '2'))
+UPSTREAM_RETRY_BACKOFF = float(getenv('UPSTREAM_RETRY_BACKOFF', '0.2'))
+
+# Consecutive failures opening the circuit of an upstream server and seconds before it is probed again
+CIRCUIT_FAILURE_THRESHOLD = int(getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+
+# Gateway errors count as upstream failures and are retried for GET requests
+retryable_status_codes = frozenset([502, 503, 504])
+
+# Values of the upstream_circuit_state gauge
+circuit_state_values = {
+    'closed': 0,
+    'half_open': 1,
+    'open': 2,
+}
+
+
+class UpstreamUnavailableError(Exception):
+    def __init__(self, upstream, reason, retry_after=None):
+        super().__init__(upstream + ' is unavailable: ' + reason)
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    def __init__(self, circuit_breaker):
+        super().__init__(circuit_breaker.upstream, 'circuit breaker is open', circuit_breaker.retry_after())
+
+
+class CircuitBreaker:
+    def __init__(self, upstream, failure_threshold, reset_timeout):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self.lock = Lock()
+        upstream_circuit_state.labels(upstream).set(circuit_state_values['closed'])
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+
+            now = monotonic()
+            if self.state == 'open' and now - self.opened_at < self.reset_timeout:
+                return False
+
+            # Half-open lets a single probe through, a probe that never reported back is replaced after the reset timeout
+            if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+                return False
+            self.set_state('half_open')
+            self.probe_started_at = now
+
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probe_started_at = None
+            if self.state != 'closed':
+                self.set_state('closed')
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_started_at = None
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
+                self.set_state('open')
+
+    def set_state(self, state):
+        self.state = state
+        upstream_circuit_state.labels(self.upstream).set(circuit_state_values[state])
+
+    def retry_after(self):
+        with self.lock:
+            if self.state != 'open':
+                return 1
+
+            return max(1, int(self.reset_timeout - (monotonic() - self.opened_at) + 0.5))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'upstream': self.upstream,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+            }
+
+
+circuit_breakers = {}
+circuit_breakers_lock = Lock()
+
+
+def get_circuit_breaker(url):
+    # One breaker per upstream origin, shared by every client of this worker process
+    split_url = urlsplit(url)
+    upstream = split_url.scheme + '://' + split_url.netloc
+    circuit_breaker = circuit_breakers.get(upstream)
+    if circuit_breaker is None:
+        with circuit_breakers_lock:
+            circuit_breaker = circuit_breakers.get(upstream)
+            if circuit_breaker is None:
+                circuit_breaker = CircuitBreaker(upstream, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+                circuit_breakers[upstream] = circuit_breaker
+
+    return circuit_breaker
+
+
+def circuit_breaker_stats():
+    with circuit_breakers_lock:
+        return [circuit_breaker.stats() for circuit_breaker in circuit_breakers.values()]
+
+
+def retry_delay(attempt, backoff=None):
+    if backoff is None:
+        backoff = UPSTREAM_RETRY_BACKOFF
+
+    # Full jitter keeps the retries of every worker from hitting a recovering upstream at the same moment
+    return random() * backoff * (2 ** attempt)
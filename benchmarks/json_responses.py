@@ -0,0 +1,84 @@
+# Import timeit function
+from timeit import timeit
+
+# Import b64encode function
+from base64 import b64encode
+
+# Import datetime module
+from datetime import datetime
+
+# Import JSONResponse class
+from fastapi.responses import JSONResponse
+
+# Import jsonable_encoder function
+from fastapi.encoders import jsonable_encoder
+
+# Import render_qr_code_image function
+from QRCodeRenderer.Renderer import render_qr_code_image
+
+# Import hospital list registry
+from HospitalList.Registry import get_hospital_registry
+
+# Import FastJSONResponse class
+from main import FastJSONResponse
+
+
+def build_payloads():
+    image = render_qr_code_image('https://example.com/validate?token=' + 'a' * 96)
+    hospitals = get_hospital_registry().hospitals[:100]
+
+    return {
+        'GetDatabaseRecord': {
+            'DoseNumberPositiveInt': 2,
+            'lastOccurrenceDate': 1635724800,
+            'hashedIdentifierNumber': 'b' * 96,
+            'createdTokenDateTime': int(datetime.now().timestamp()),
+            'Token': 'c' * 96,
+            'base64EncodedImage': b64encode(image),
+        },
+        'GenerateQRCode': {
+            'validation_url': 'https://example.com/validate?token=' + 'a' * 96,
+            'base64EncodedImage': b64encode(image),
+        },
+        'fhir_server': {
+            'fhir_server': 'https://fhir.example.com/fhir',
+            'fhir_token': 'd' * 64,
+            'created_at': datetime.now(),
+        },
+        'SearchHospital': {
+            'total': len(hospitals),
+            'page': 1,
+            'page_size': len(hospitals),
+            'hospitals': [hospital._asdict() for hospital in hospitals],
+        },
+        'VerifyResult': {
+            'result': 'Success',
+            'VerifyNo': 'e' * 36,
+            'QueryResultCode': '0',
+            'QueryReturnCode': '0',
+        },
+    }
+
+
+def measure_encoded(response_class, payload, number):
+    # FastAPI encodes a returned dict with jsonable_encoder before the response class renders it
+    seconds = timeit(lambda: response_class(jsonable_encoder(payload)), number=number)
+
+    return seconds / number * 1000000
+
+
+def measure_direct(response_class, payload, number):
+    seconds = timeit(lambda: response_class(payload), number=number)
+
+    return seconds / number * 1000000
+
+
+if __name__ == '__main__':
+    # Run with python -m benchmarks.json_responses from the project root
+    number = 2000
+    print('%-20s %12s %14s %14s %8s' % ('response', 'json (us)', 'encoded (us)', 'direct (us)', 'speedup'))
+    for route_name, payload in build_payloads().items():
+        before = measure_encoded(JSONResponse, payload, number)
+        encoded = measure_encoded(FastJSONResponse, payload, number)
+        direct = measure_direct(FastJSONResponse, payload, number)
+        print('%-20s %12.1f %14.1f %14.1f %7.2fx' % (route_name, before, encoded, direct, before / direct))
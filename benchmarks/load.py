@@ -0,0 +1,345 @@
+# Import argparse module
+import argparse
+
+# Import asyncio module
+import asyncio
+
+# Import httpx module
+import httpx
+
+# Import platform module
+import platform
+
+# Import subprocess module
+import subprocess
+
+# Import sys module
+import sys
+
+# Import b64encode function
+from base64 import b64encode
+
+# Import datetime module
+from datetime import datetime
+
+# Import dumps and loads functions
+from json import dumps, loads
+
+# Import os functions
+from os import environ, makedirs
+
+# Import os.path functions
+from os.path import abspath, dirname, join
+
+# Import random module functions
+from random import choice, randrange
+
+# Import copyfile function
+from shutil import copyfile, rmtree
+
+# Import socket module
+import socket
+
+# Import mkdtemp function
+from tempfile import mkdtemp
+
+# Import perf_counter function
+from time import perf_counter
+
+# Import uuid4 function
+from uuid import uuid4
+
+# Import mock upstream servers
+from benchmarks.mock_fhir import start_mock_fhir_server
+from benchmarks.mock_twca import start_mock_id_portal
+
+project_root = dirname(dirname(abspath(__file__)))
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def prepare_workdir(id_portal_url):
+    # Every run gets its own SQLite files, hospital list and TWCA config
+    workdir = mkdtemp(prefix='hospital_system_server_benchmark_')
+    copyfile(join(project_root, 'hospital.csv'), join(workdir, 'hospital.csv'))
+    with open(join(workdir, 'config.txt'), 'w') as file_handler:
+        file_handler.write('BusinessNo:12345678\nHashKey:benchmark-hash-key\nHashKeyNo:1\n')
+    makedirs(join(workdir, 'prometheus_multiproc'))
+
+    env = dict(environ)
+    env.update({
+        'PYTHONPATH': project_root,
+        'TMPDIR': workdir,
+        'TWID_DATABASE_PATH': join(workdir, 'twid_verify_no.sqlite3'),
+        'TWCA_QUERY_VERIFY_RESULT_URL': id_portal_url + '/QueryVerifyResult',
+        'PROMETHEUS_MULTIPROC_DIR': join(workdir, 'prometheus_multiproc'),
+    })
+
+    return workdir, env
+
+
+def start_app_server(args, port, workdir, env):
+    if args.server == 'gunicorn':
+        command = [
+            sys.executable, '-m', 'gunicorn', 'main:app',
+            '-c', join(project_root, 'gunicorn.conf.py'),
+            '-w', str(args.workers),
+            '-k', 'uvicorn.workers.UvicornWorker',
+            '-b', '127.0.0.1:%d' % port,
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'main:app',
+            '--workers', str(args.workers),
+            '--host', '127.0.0.1',
+            '--port', str(port),
+            '--log-level', 'warning',
+        ]
+
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_ready(client, timeout=30):
+    started_at = perf_counter()
+    while perf_counter() - started_at < timeout:
+        try:
+            if (await client.get('/')).status_code == 200:
+                return True
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+
+    raise RuntimeError('the application server did not start within %d seconds' % timeout)
+
+
+async def prepare_state(client, args, fhir_url):
+    state = {'identifiers': [], 'tokens': [], 'login_tokens': []}
+    response = await client.post('/api/fhir_server', json={'fhir_server': fhir_url})
+    response.raise_for_status()
+
+    for index in range(args.records):
+        identifier_number = 'BENCH%06d' % index
+        await client.post('/api/InsertDatabaseRecord', json={
+            'dose_number_positive_int': 2,
+            'last_occurrence_date': 20211101,
+            'identifier_number': identifier_number,
+            'immunization_id': uuid4().hex,
+        })
+        response = await client.post('/api/GetDatabaseRecord', json={'identifier_number': identifier_number, 'ip_address': 'http://127.0.0.1'})
+        state['identifiers'].append(identifier_number)
+        state['tokens'].append(response.json()['Token'])
+
+    for index in range(args.logins):
+        response = await client.post('/TWCA-api/api/LoginTWIDPortal', json=build_login_payload(args.id_portal_url))
+        state['login_tokens'].append(loads(response.json()['OutputParams'])['Token'])
+
+    return state
+
+
+def build_login_payload(id_portal_url):
+    return {
+        'url': id_portal_url,
+        'member_no': 'A123456789',
+        'action': 'ValidateMSISDNAdvance',
+        'plain_text': 'A123456789',
+        'ca_type': '1',
+        'assign_cert_password': '',
+        'operator': '1',
+        'msisdn': '0912345678',
+        'birthday': '19900101',
+        'return_url': 'http://127.0.0.1/TWCA-api/api/VerifyResult',
+    }
+
+
+def build_scenarios(args):
+    dose_input_list = b64encode(dumps([
+        {'doseManufactureName': 'AZ', 'doseNumber': 1, 'vaccinateDateStr': '2021-06-01'},
+        {'doseManufactureName': 'Moderna', 'doseNumber': 2, 'vaccinateDateStr': '2021-09-01'},
+    ]).encode('utf-8')).decode('utf-8')
+    patient = dumps({'resourceType': 'Patient', 'name': [{'text': 'Benchmark'}], 'gender': 'female'}).encode('utf-8')
+
+    # Every scenario turns the prepared state into the arguments of one httpx request
+    return {
+        'QueryPatient': lambda state: ('GET', '/api/QueryPatient/%d' % randrange(args.patient_ids), {}),
+        'GetOrganization': lambda state: ('GET', '/api/GetOrganization/%d' % randrange(args.patient_ids), {}),
+        'SearchImmunization': lambda state: ('POST', '/api/SearchImmunization', {'json': {'search_params': 'patient=%d' % randrange(args.patient_ids)}}),
+        'PatientList': lambda state: ('GET', '/api/PatientList', {}),
+        'CreatePatient': lambda state: ('POST', '/api/CreatePatient', {'content': patient, 'headers': {'Content-Type': 'application/fhir+json'}}),
+        'GetDatabaseRecord': lambda state: ('POST', '/api/GetDatabaseRecord', {'json': {'identifier_number': choice(state['identifiers']), 'ip_address': 'http://127.0.0.1'}}),
+        'GenerateQRCode': lambda state: ('POST', '/api/GenerateQRCode', {'json': {'identifier_number': choice(state['identifiers']), 'ip_address': 'http://127.0.0.1'}}),
+        'ValidateQRCode': lambda state: ('POST', '/api/ValidateQRCode', {'json': {'token': choice(state['tokens'])}}),
+        'RegisterVaccine': lambda state: ('POST', '/api/RegisterVaccine', {'json': {
+            'vaccinePersonName': 'Benchmark',
+            'identityNumber': uuid4().hex,
+            'doseInputList': dose_input_list,
+        }}),
+        'GetHospitalLists': lambda state: ('GET', '/api/GetHospitalLists', {}),
+        'SearchHospital': lambda state: ('POST', '/api/SearchHospital', {'json': {'page_size': 20}}),
+        'LoginTWIDPortal': lambda state: ('POST', '/TWCA-api/api/LoginTWIDPortal', {'json': build_login_payload(args.id_portal_url)}),
+        'VerifyResult': lambda state: ('POST', '/TWCA-api/api/VerifyResult', {'data': {
+            'BusinessNo': '12345678',
+            'ApiVersion': '1.0',
+            'HashKeyNo': '1',
+            'VerifyNo': uuid4().hex,
+            'MemberNoMapping': 'A123456789',
+            'Token': choice(state['login_tokens']),
+            'CAType': '1',
+            'ResultCode': '0',
+            'ReturnCode': '0',
+            'ReturnCodeDesc': 'Success',
+            'IdentifyNo': uuid4().hex,
+        }}),
+        'QueryVerifyResult': lambda state: ('POST', '/api/QueryVerifyResult', {'json': {'token': choice(state['login_tokens'])}}),
+    }
+
+
+def percentile(sorted_values, rank):
+    if len(sorted_values) == 0:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(rank / 100 * len(sorted_values))) - 1))
+
+    return sorted_values[index]
+
+
+async def run_scenario(client, scenario, state, concurrency, duration):
+    latencies = []
+    status_codes = {}
+    errors = {'count': 0}
+    deadline = perf_counter() + duration
+
+    async def worker():
+        while perf_counter() < deadline:
+            method, path, kwargs = scenario(state)
+            started_at = perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                await response.aread()
+            except httpx.HTTPError:
+                errors['count'] += 1
+                continue
+            latencies.append(perf_counter() - started_at)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+    started_at = perf_counter()
+    await asyncio.gather(*[worker() for index in range(concurrency)])
+    elapsed = perf_counter() - started_at
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'transport_errors': errors['count'],
+        'status_codes': {str(status_code): count for status_code, count in sorted(status_codes.items())},
+        'rps': len(latencies) / elapsed,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if len(latencies) > 0 else None,
+        'p50_ms': percentile(latencies, 50) * 1000 if len(latencies) > 0 else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if len(latencies) > 0 else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if len(latencies) > 0 else None,
+    }
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=project_root, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args, app_url, fhir_url):
+    scenarios = build_scenarios(args)
+    route_names = args.routes.split(',') if args.routes else list(scenarios.keys())
+    unknown_routes = [route_name for route_name in route_names if route_name not in scenarios]
+    if len(unknown_routes) > 0:
+        raise ValueError('unknown routes: ' + ', '.join(unknown_routes))
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as client:
+        await wait_until_ready(client)
+        state = await prepare_state(client, args, fhir_url)
+        results = {}
+        for route_name in route_names:
+            if args.warmup > 0:
+                await run_scenario(client, scenarios[route_name], state, args.concurrency, args.warmup)
+            results[route_name] = await run_scenario(client, scenarios[route_name], state, args.concurrency, args.duration)
+            print('%-20s %10.1f rps  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %s' % (
+                route_name,
+                results[route_name]['rps'],
+                results[route_name]['p50_ms'] or 0,
+                results[route_name]['p95_ms'] or 0,
+                results[route_name]['p99_ms'] or 0,
+                results[route_name]['status_codes'],
+            ))
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load benchmark of main:app against local FHIR and TWCA IDPortal stand-ins.')
+    parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10, help='seconds measured per route')
+    parser.add_argument('--warmup', type=float, default=1, help='seconds of unmeasured load before each route')
+    parser.add_argument('--routes', default='', help='comma separated scenario names, all of them by default')
+    parser.add_argument('--fhir-latency-ms', type=float, default=20)
+    parser.add_argument('--fhir-payload-bytes', type=int, default=4096)
+    parser.add_argument('--fhir-bundle-size', type=int, default=20)
+    parser.add_argument('--twca-latency-ms', type=float, default=50)
+    parser.add_argument('--patient-ids', type=int, default=1000, help='number of distinct resource ids requested')
+    parser.add_argument('--records', type=int, default=100, help='passport token records created before the run')
+    parser.add_argument('--logins', type=int, default=20, help='TWID Portal logins created before the run')
+    parser.add_argument('--output', default='', help='JSON result path, benchmarks/results/<time>.json by default')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fhir_server = start_mock_fhir_server(args.fhir_latency_ms / 1000, args.fhir_payload_bytes, args.fhir_bundle_size)
+    id_portal = start_mock_id_portal(args.twca_latency_ms / 1000)
+    fhir_url = 'http://127.0.0.1:%d' % fhir_server.server_port
+    args.id_portal_url = 'http://127.0.0.1:%d' % id_portal.server_port
+
+    port = get_free_port()
+    workdir, env = prepare_workdir(args.id_portal_url)
+    app_server = start_app_server(args, port, workdir, env)
+    try:
+        results = asyncio.run(run_benchmark(args, 'http://127.0.0.1:%d' % port, fhir_url))
+    finally:
+        app_server.terminate()
+        app_server.wait()
+        fhir_server.shutdown()
+        id_portal.shutdown()
+        rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'settings': {
+            'server': args.server,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'fhir_latency_ms': args.fhir_latency_ms,
+            'fhir_payload_bytes': args.fhir_payload_bytes,
+            'fhir_bundle_size': args.fhir_bundle_size,
+            'twca_latency_ms': args.twca_latency_ms,
+            'patient_ids': args.patient_ids,
+        },
+        'routes': results,
+    }
+    output_path = args.output or join(project_root, 'benchmarks', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    makedirs(dirname(abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as file_handler:
+        file_handler.write(dumps(report, indent=2))
+    print('Results are saved to ' + output_path)
+
+
+if __name__ == '__main__':
+    # Run with python -m benchmarks.load from the project root
+    main()
@@ -0,0 +1,89 @@
+# Import BaseHTTPRequestHandler class
+from http.server import BaseHTTPRequestHandler
+
+# Import dumps and loads functions
+from json import dumps, loads
+
+# Import urlsplit and parse_qs functions
+from urllib.parse import urlsplit, parse_qs
+
+# Import Thread class
+from threading import Thread
+
+# Import sleep function
+from time import sleep
+
+# Import MockHTTPServer class
+from benchmarks.mock_server import MockHTTPServer
+
+
+class MockFHIRHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_resource(self, status_code, resource):
+        sleep(self.server.latency)
+        body = dumps(resource).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/fhir+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def build_resource(self, resource_type, resource_id):
+        # The narrative pads every resource to the configured payload size
+        return {
+            'resourceType': resource_type,
+            'id': resource_id,
+            'meta': {'versionId': '1', 'lastUpdated': '2021-11-01T00:00:00Z'},
+            'text': {'status': 'generated', 'div': '<div>' + 'x' * self.server.payload_size + '</div>'},
+        }
+
+    def build_bundle(self, resource_type, count):
+        return {
+            'resourceType': 'Bundle',
+            'type': 'searchset',
+            'total': count,
+            'entry': [{'resource': self.build_resource(resource_type, str(index))} for index in range(count)],
+        }
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path_parts = [part for part in url.path.split('/') if part != '']
+        if path_parts == ['metadata']:
+            self.send_resource(200, {'resourceType': 'CapabilityStatement', 'rest': [{'interaction': [{'code': 'batch'}]}]})
+        elif len(path_parts) == 2:
+            self.send_resource(200, self.build_resource(path_parts[0], path_parts[1]))
+        elif len(path_parts) == 1:
+            count = int(parse_qs(url.query).get('_count', [self.server.bundle_size])[0])
+            self.send_resource(200, self.build_bundle(path_parts[0], min(count, self.server.bundle_size)))
+        else:
+            self.send_resource(404, {'resourceType': 'OperationOutcome'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        try:
+            resource = loads(body)
+        except ValueError:
+            self.send_resource(400, {'resourceType': 'OperationOutcome'})
+            return
+        resource['id'] = '1'
+        self.send_resource(201, resource)
+
+    def do_PUT(self):
+        self.do_POST()
+
+    def do_DELETE(self):
+        self.send_resource(200, {'resourceType': 'OperationOutcome'})
+
+
+def start_mock_fhir_server(latency=0.02, payload_size=4096, bundle_size=20, host='127.0.0.1', port=0):
+    server = MockHTTPServer((host, port), MockFHIRHandler)
+    server.latency = latency
+    server.payload_size = payload_size
+    server.bundle_size = bundle_size
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
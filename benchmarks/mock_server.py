@@ -0,0 +1,15 @@
+# Import sys module
+import sys
+
+# Import ThreadingHTTPServer class
+from http.server import ThreadingHTTPServer
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Load clients cancel or close connections while a response is written, only other errors are worth a traceback
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
@@ -0,0 +1,62 @@
+# Import BaseHTTPRequestHandler class
+from http.server import BaseHTTPRequestHandler
+
+# Import dumps function
+from json import dumps
+
+# Import Thread class
+from threading import Thread
+
+# Import sleep function
+from time import sleep
+
+# Import datetime module
+from datetime import datetime
+
+# Import uuid4 function
+from uuid import uuid4
+
+# Import MockHTTPServer class
+from benchmarks.mock_server import MockHTTPServer
+
+
+class MockIDPortalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_result(self, result):
+        sleep(self.server.latency)
+        body = dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        timestamp = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        if self.path.endswith('/Login'):
+            output_params = {'Token': uuid4().hex, 'TimeStamp': timestamp}
+        elif self.path.endswith('/QueryVerifyResult'):
+            output_params = {'VerifyTime': timestamp}
+        else:
+            self.send_result({'ReturnCode': '9999', 'ResultCode': '9999', 'ReturnCodeDesc': 'unknown API'})
+            return
+
+        self.send_result({
+            'ReturnCode': '0',
+            'ResultCode': '0',
+            'ReturnCodeDesc': 'Success',
+            'OutputParams': dumps(output_params),
+        })
+
+
+def start_mock_id_portal(latency=0.05, host='127.0.0.1', port=0):
+    server = MockHTTPServer((host, port), MockIDPortalHandler)
+    server.latency = latency
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,11 @@
+# Import getenv function
+from os import getenv
+
+# Import multiprocess module
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Live gauges of an exited worker must not be summed into /metrics any more
+    if getenv('PROMETHEUS_MULTIPROC_DIR') is not None:
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,8 @@
 # Calling the FastAPI library
-from fastapi import FastAPI, Response, Form, status
+from fastapi import FastAPI, Request, Response, Form, Header, Query, status
+
+# Import StreamingResponse class
+from fastapi.responses import StreamingResponse, JSONResponse
 
 # Add CORS middleware module
 from fastapi.middleware.cors import CORSMiddleware
@@ -7,54 +10,129 @@ from fastapi.middleware.cors import CORSMiddleware
 # Import BaseModel module
 from pydantic import BaseModel
 
-# Import optional body params module
-from typing import Optional
+# Import optional body params and list modules
+from typing import Optional, List
 
 # Import requests module
 import requests
 
+# Import httpx module
+import httpx
+
 # Import random module
 import random
 
+# Import re module
+import re
+
 # Import secrets.token_hex module
 from secrets import token_hex
 
-# Import sqlite3 module
-import sqlite3
-
 # Import sha3 module
 from hashlib import sha3_384
 
 # Import sha3 module
 from hashlib import sha256
 
-# Import gettempdir module
-from tempfile import gettempdir
-
-# Import FHIR Client class
-from FHIRClient.Client import Client
+# Import asynchronous FHIR Client class
+from FHIRClient.AsyncClient import AsyncClient, close_shared_clients
+
+# Import close_shared_sessions function of the synchronous FHIR Client
+from FHIRClient.Client import close_shared_sessions
+
+# Import resource_cache instance
+from FHIRClient.ResourceCache import resource_cache
+
+# Import storage helpers
+from Storage.Database import (
+    open_databases,
+    close_databases,
+    hospital_db,
+    store_fhir_passport_token,
+    store_fhir_server_setting,
+    query_fhir_server_setting,
+    store_vaccine_registers,
+    query_passport_token,
+    query_database_by_hashed_identified_number,
+    update_query_verify_no,
+    store_verify_no,
+    store_verify_callback,
+    update_query_verify_error,
+    renew_verify_callback_leases,
+    claim_expired_verify_callbacks,
+    TWCA_VERIFY_LEASE_SECONDS,
+    query_verify_outcome,
+    prune_expired_records,
+)
+
+# Import passport token expiry
+from Storage.TokenStore import TOKEN_EXPIRY_SECONDS
+
+# Import hospital list registry
+from HospitalList.Registry import get_hospital_registry
+
+# Import QR code renderer
+from QRCodeRenderer.Renderer import (
+    get_qr_code_image,
+    qr_code_cache,
+    shutdown_render_executor,
+    error_correction_levels,
+    image_media_types,
+)
+
+# Import Prometheus metrics helpers
+from Monitoring.Metrics import MetricsMiddleware, generate_metrics, qr_code_image_duration_seconds
+
+# Import request profiling helpers
+from Monitoring.Profiler import (
+    ProfilerMiddleware,
+    profiling_enabled,
+    is_admin_token,
+    list_profiles,
+    load_profile,
+    to_collapsed_stacks,
+    to_speedscope,
+)
+
+# Import upstream timeouts and circuit breakers
+from Upstream.CircuitBreaker import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UpstreamUnavailableError,
+    circuit_breaker_stats,
+    retry_delay,
+)
+
+# Import CONTENT_TYPE_LATEST constant
+from prometheus_client import CONTENT_TYPE_LATEST
+
+# Import perf_counter function
+from time import perf_counter
 
 # Import TWCA Client class
-from TWCAClient.Client import Client as TWCAClient
+from TWCAClient.Client import Client as TWCAClient, close_shared_portal_clients
 
 # Import json.loads module
 from json import loads
 
+# Import orjson module
+import orjson
+
 # Import base64 decode module
 from base64 import b64decode, b64encode
 
 # Import datetime module
 from datetime import datetime
 
-# Import qrcode module
-import qrcode
-
-# Import ByteIO function
-from io import BytesIO
-
 # Import isfile function
 from os.path import isfile
 
+# Import Lock class
+from threading import Lock
+
+# Import getenv and getpid functions
+from os import getenv, getpid
+
 # Import uuid4 function
 from uuid import uuid4
 
@@ -63,14 +141,199 @@ from json import dumps
 
 from requests.api import post
 
+# Import asyncio module
+import asyncio
+
+# Import asynccontextmanager decorator
+from contextlib import asynccontextmanager
+
+# Import sqlite3 module
+import sqlite3
+
+# Import logging module
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two retention sweeps of the TWID verify table
+RETENTION_SWEEP_INTERVAL = int(getenv('RETENTION_SWEEP_INTERVAL', '300'))
+
+# Outcome of the latest retention sweep run by this worker
+retention_report = {
+    'swept_at': None,
+    'tables': {},
+}
+
+async def run_retention_sweeper():
+    while True:
+        try:
+            # Deletes run in a thread so that the event loop keeps serving requests between batches
+            tables = await asyncio.to_thread(prune_expired_records)
+            retention_report['swept_at'] = int(datetime.now().timestamp())
+            retention_report['tables'] = tables
+        except sqlite3.Error:
+            logger.exception('Error when sweeping expired records')
+        await asyncio.sleep(RETENTION_SWEEP_INTERVAL)
+
+# Seconds until a FHIR server setting stored by another worker is picked up by this one
+FHIR_SERVER_SETTING_REFRESH_INTERVAL = float(getenv('FHIR_SERVER_SETTING_REFRESH_INTERVAL', '1'))
+
+async def run_fhir_server_setting_watcher():
+    while True:
+        await asyncio.sleep(FHIR_SERVER_SETTING_REFRESH_INTERVAL)
+        try:
+            await asyncio.to_thread(refresh_fhir_server_cache)
+        except sqlite3.Error:
+            logger.exception('Error when refreshing the FHIR server setting')
+
+# Background workers querying the TWID Portal after each VerifyResult callback, and the extra attempts of every query
+TWCA_VERIFY_RESULT_WORKERS = int(getenv('TWCA_VERIFY_RESULT_WORKERS', '4'))
+TWCA_QUERY_VERIFY_RETRIES = int(getenv('TWCA_QUERY_VERIFY_RETRIES', '3'))
+TWCA_QUERY_VERIFY_RETRY_BACKOFF = float(getenv('TWCA_QUERY_VERIFY_RETRY_BACKOFF', '2'))
+
+# Callbacks waiting for their follow-up, the queue is created by the lifespan because it is bound to the event loop
+verify_result_jobs = {
+    'queue': None,
+}
+
+async def run_verify_result_worker(queue):
+    while True:
+        login_token, member_no, callback_form = await queue.get()
+        try:
+            await query_verify_result_with_retries(login_token, member_no, callback_form)
+        except Exception as e:
+            # One broken callback must not stop the worker, and the lease keeper would renew its lease forever, so it is failed here
+            logger.exception('Error when querying the verified result')
+            try:
+                await asyncio.to_thread(update_query_verify_error, login_token, None, 'failed', type(e).__name__ + ': ' + str(e))
+            except sqlite3.Error:
+                logger.exception('Error when failing the VerifyResult callback')
+        finally:
+            queue.task_done()
+
+async def run_verify_lease_keeper(queue):
+    # Leases are renewed well before they expire, callbacks of workers that stopped renewing them are taken over
+    while True:
+        try:
+            await asyncio.to_thread(renew_verify_callback_leases)
+            for expired_callback in await asyncio.to_thread(claim_expired_verify_callbacks):
+                queue.put_nowait(expired_callback)
+        except sqlite3.Error:
+            logger.exception('Error when renewing the VerifyResult callback leases')
+        await asyncio.sleep(TWCA_VERIFY_LEASE_SECONDS / 3)
+
+async def query_verify_result_with_retries(login_token, member_no, callback_form):
+    twca_config = get_twca_config()
+    if 'error' in twca_config.keys():
+        await asyncio.to_thread(update_query_verify_error, login_token, 0, 'failed', twca_config['error'])
+        return
+
+    plain_text = (
+        callback_form['BusinessNo'] + callback_form['ApiVersion'] + callback_form['HashKeyNo'] +
+        callback_form['VerifyNo'] + member_no + login_token + twca_config['hash_key']
+    )
+    twca_client = TWCAClient(twca_query_verify_result_url)
+    payload = {
+        'BusinessNo': callback_form['BusinessNo'],
+        'ApiVersion': callback_form['ApiVersion'],
+        'HashKeyNo': callback_form['HashKeyNo'],
+        'VerifyNo': callback_form['VerifyNo'],
+        'MemberNo': member_no,
+        'Token': login_token,
+        'IdentifyNo': identify_generator(plain_text),
+    }
+    for attempt in range(1 + TWCA_QUERY_VERIFY_RETRIES):
+        try:
+            query_verified_response = await twca_client.query_verified_result(payload)
+            query_return_code = query_verified_response['ReturnCode']
+            query_result_code = query_verified_response['ResultCode']
+            output_params = loads(query_verified_response.get('OutputParams') or '{}')
+            if isinstance(output_params, dict) is False:
+                raise ValueError('OutputParams is not a JSON object')
+        except (UpstreamUnavailableError, ValueError, KeyError, TypeError, AttributeError) as e:
+            query_status = 'failed' if attempt == TWCA_QUERY_VERIFY_RETRIES else 'pending'
+            await asyncio.to_thread(update_query_verify_error, login_token, attempt + 1, query_status, type(e).__name__ + ': ' + str(e))
+            if query_status == 'failed':
+                return
+            # An open circuit breaker knows when the IDPortal is probed again
+            await asyncio.sleep(max(retry_delay(attempt, TWCA_QUERY_VERIFY_RETRY_BACKOFF), getattr(e, 'retry_after', None) or 0))
+            continue
+
+        await asyncio.to_thread(
+            update_query_verify_no,
+            login_token,
+            query_return_code,
+            query_result_code,
+            output_params.get('VerifyTime'),
+            attempt + 1,
+        )
+        return
+
+# Open worker-wide resources on startup and release them when the application is shut down
+@asynccontextmanager
+async def lifespan(app):
+    open_databases()
+    get_hospital_registry()
+    await asyncio.to_thread(refresh_fhir_server_cache, True)
+    fhir_server_setting_watcher = asyncio.create_task(run_fhir_server_setting_watcher())
+    retention_sweeper = None
+    if RETENTION_SWEEP_INTERVAL > 0:
+        retention_sweeper = asyncio.create_task(run_retention_sweeper())
+    verify_result_queue = asyncio.Queue()
+    verify_result_jobs['queue'] = verify_result_queue
+    verify_result_workers = [
+        asyncio.create_task(run_verify_result_worker(verify_result_queue)) for _ in range(TWCA_VERIFY_RESULT_WORKERS)
+    ]
+    verify_result_workers.append(asyncio.create_task(run_verify_lease_keeper(verify_result_queue)))
+    yield
+    fhir_server_setting_watcher.cancel()
+    if retention_sweeper is not None:
+        retention_sweeper.cancel()
+    for verify_result_worker in verify_result_workers:
+        verify_result_worker.cancel()
+    verify_result_jobs['queue'] = None
+    await close_shared_clients()
+    # Sessions pooled by synchronous FHIR Client users such as scripts importing the application
+    close_shared_sessions()
+    await close_shared_portal_clients()
+    close_databases()
+    shutdown_render_executor()
+
+def encode_json_default(value):
+    # Base64 encoded images are built as bytes, orjson already handles datetimes on its own
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    raise TypeError('Type is not JSON serializable: ' + type(value).__name__)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return orjson.dumps(content, default=encode_json_default)
+
 # Declaring as the main app to use FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 origins = [
     '*',
 ]
 
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_methods=['*'], allow_headers=['*'])
+app.add_middleware(MetricsMiddleware)
+if profiling_enabled():
+    # Without an admin token or a sample rate the profiler is not even part of the middleware stack
+    app.add_middleware(ProfilerMiddleware)
+
+# Fail fast with 503 when an upstream server timed out, kept failing or has its circuit breaker open
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    headers = {}
+    if exc.retry_after is not None:
+        headers['Retry-After'] = str(exc.retry_after)
+
+    return FastJSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'error': 'Upstream server is unavailable.', 'upstream': exc.upstream, 'reason': exc.reason},
+        headers=headers,
+    )
 
 # Create GET method API at the Root URL when going to the localhost
 @app.get('/')
@@ -94,6 +357,7 @@ def fhir_server_setup(fhir_model: FHIRModel, response: Response):
         return {'error': 'fhir_server field value is invalid.'}
 
     store_fhir_server_setting(fhir_data['fhir_server'], fhir_data['fhir_token'])
+    refresh_fhir_server_cache(force=True)
 
     if fhir_data['fhir_token'] is not None:
         return {'result': 'fhir_server setting is done!', 'fhir_server': fhir_data['fhir_server'], 'fhir_token': fhir_data['fhir_token']}
@@ -112,17 +376,14 @@ def fhir_server_setup(response: Response):
 
 # Create GET method API and query specific FHIR Resources by id
 @app.get('/api/QueryPatient/{patient_id}')
-def query_patient_resource_by_id(patient_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def query_patient_resource_by_id(patient_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_patient_resource_by_id(patient_id)
+    fhir_client_response = await fhir_client.get_patient_resource_by_id(patient_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -132,23 +393,19 @@ class FHIRServerSearchParamsModel(BaseModel):
 
 # Create POST method API to query Patient Resources by searching params
 @app.post('/api/SearchPatient')
-def query_patient_resource_by_search_params(search_params_model: FHIRServerSearchParamsModel, response: Response):
+async def query_patient_resource_by_search_params(search_params_model: FHIRServerSearchParamsModel, response: Response, passthrough: bool = False):
     post_data = search_params_model.dict()
     if check_json_field(post_data, 'search_params') is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'search_params field is missed.'}
 
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_patient_resource_by_search(post_data['search_params'])
+    fhir_client_response = await fhir_client.get_patient_resource_by_search(post_data['search_params'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -159,88 +416,107 @@ class PatientResourceModel(BaseModel):
 class CreatePatientResourceModel(BaseModel):
     json_payload: str
 
-# Create POST method API to create new Patient Resource
-@app.post('/api/CreatePatient')
-def create_patient_resource(patient_resource_model: CreatePatientResourceModel, response: Response):
-    post_data = patient_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
+def fhir_payload_openapi(envelope_model):
+    # Create and update routes read their body themselves, so both accepted media types are documented here
+    return {
+        'requestBody': {
+            'required': True,
+            'content': {
+                'application/json': {'schema': envelope_model.model_json_schema()},
+                'application/fhir+json': {'schema': {'type': 'object'}},
+            },
+        },
+    }
 
-    if fhir_server is False:
+# Create POST method API to create new Patient Resource
+@app.post('/api/CreatePatient', openapi_extra=fhir_payload_openapi(CreatePatientResourceModel))
+async def create_patient_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload field is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_patient_resource(json_payload.encode('utf-8'))
+    fhir_client_response = await fhir_client.upload_patient_resource(fhir_payload['payload'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create PUT method API to update existed Patient Resource
-@app.put('/api/UpdatePatient')
-def update_patient_resource(patient_resource_model: PatientResourceModel, response: Response):
-    post_data = patient_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
+@app.put('/api/UpdatePatient', openapi_extra=fhir_payload_openapi(PatientResourceModel))
+async def update_patient_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload field is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+    patient_id = fhir_payload['post_data'].get('patient_id')
+    if patient_id is None or patient_id == '':
+        # A raw resource body may leave the Patient id to its own id field
+        patient_id = fhir_payload['resource'].get('id') if isinstance(fhir_payload['resource'], dict) else None
+    if patient_id is None or patient_id == '':
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload field is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
+        return {'error': 'patient_id field is missed.'}
 
-    if fhir_server is False:
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.update_patient_resource(json_payload.encode('utf-8'), post_data['patient_id'])
+    fhir_client_response = await fhir_client.update_patient_resource(fhir_payload['payload'], str(patient_id), stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create DELETE method API to delete existed Patient Resource
 @app.delete('/api/DeletePatient/{patient_id}')
-def delete_patient_resource(patient_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def delete_patient_resource(patient_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.delete_patient_resource_by_id(patient_id)
+    fhir_client_response = await fhir_client.delete_patient_resource_by_id(patient_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
-# Create GET method API to get Patient Resource lists
+# Create GET method API to get Patient Resource lists, or every page of them as NDJSON
 @app.get('/api/PatientList')
-def get_patient_resource(response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
+async def get_patient_resource(
+        response: Response,
+        passthrough: bool = False,
+        ndjson: bool = False,
+        count: Optional[int] = Query(None, alias='_count'),
+        max_entries: Optional[int] = None,
+    ):
+    if (count is not None and count < 1) or (max_entries is not None and max_entries < 1):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': '_count and max_entries should be positive.'}
 
-    if fhir_server is False:
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_patient_lists()
+    try:
+        fhir_client_response = await fhir_client.get_patient_lists(stream=passthrough and not ndjson, count=count)
+    except UpstreamUnavailableError as error:
+        if ndjson is False:
+            raise
+        # NDJSON readers get the same error line as a failed page, before any entry was sent
+        return StreamingResponse(
+            iter([dumps({'error': 'Bundle page request is failed: ' + str(error), 'status_code': status.HTTP_503_SERVICE_UNAVAILABLE}) + '\n']),
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(error.retry_after)} if error.retry_after is not None else {},
+            media_type='application/x-ndjson',
+        )
+    if ndjson is True and fhir_client_response.status_code == 200:
+        return StreamingResponse(stream_bundle_entries(fhir_client, fhir_client_response, max_entries), media_type='application/x-ndjson')
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -248,46 +524,33 @@ class OrganizationResourceModel(BaseModel):
     json_payload: str
 
 # Create POST method API to create Organization Resource
-@app.post('/api/CreateOrganization')
-def create_organization_resource(org_resource_model: OrganizationResourceModel, response: Response):
-    post_data = org_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+@app.post('/api/CreateOrganization', openapi_extra=fhir_payload_openapi(OrganizationResourceModel))
+async def create_organization_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_organization_resource(json_payload.encode('utf-8'))
+    fhir_client_response = await fhir_client.upload_organization_resource(fhir_payload['payload'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create GET method API to query Organization Resource by id
 @app.get('/api/GetOrganization/{organization_id}')
-def get_organization_resource_by_id(organization_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def get_organization_resource_by_id(organization_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_organization_resource_by_id(organization_id)
+    fhir_client_response = await fhir_client.get_organization_resource_by_id(organization_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -295,63 +558,46 @@ class ImmunizationResourceModel(BaseModel):
     json_payload: str
 
 # Create POST method API to create immunization resource bundle
-@app.post('/api/CreateImmunization')
-def create_immunization_resource(immunization_resource_model: ImmunizationResourceModel, response: Response):
-    post_data = immunization_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+@app.post('/api/CreateImmunization', openapi_extra=fhir_payload_openapi(ImmunizationResourceModel))
+async def create_immunization_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_immunization_resource(json_payload.encode('utf-8'))
+    fhir_client_response = await fhir_client.upload_immunization_resource(fhir_payload['payload'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create GET method API to query Immunization Resource by id
 @app.get('/api/GetImmunization/{immunization_id}')
-def get_immunization_resource_by_id(immunization_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def get_immunization_resource_by_id(immunization_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_immunization_resource_by_id(immunization_id)
+    fhir_client_response = await fhir_client.get_immunization_resource_by_id(immunization_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create GET method API to query Composition Resource by id
 @app.get('/api/GetComposition/{composition_id}')
-def get_composition_resource_by_id(composition_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def get_composition_resource_by_id(composition_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_composition_resource_by_id(composition_id)
+    fhir_client_response = await fhir_client.get_composition_resource_by_id(composition_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -359,63 +605,46 @@ class CompositionResourceModel(BaseModel):
     json_payload: str
 
 # Create POST method API to create composition resource
-@app.post('/api/CreateComposition')
-def create_compposition_resource(composition_resource_model: CompositionResourceModel, response: Response):
-    post_data = composition_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+@app.post('/api/CreateComposition', openapi_extra=fhir_payload_openapi(CompositionResourceModel))
+async def create_compposition_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_composition_resource(json_payload.encode('utf-8'))
+    fhir_client_response = await fhir_client.upload_composition_resource(fhir_payload['payload'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create GET method API to query Observation Bundle Resource by id
 @app.get('/api/GetObservationBundle/{observation_bundle_id}')
-def get_observation_bundle_resource_by_id(observation_bundle_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def get_observation_bundle_resource_by_id(observation_bundle_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_observation_bundle_resource_by_id(observation_bundle_id)
+    fhir_client_response = await fhir_client.get_observation_bundle_resource_by_id(observation_bundle_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
 # Create GET method API to query Observation Resource by id
 @app.get('/api/GetObservation/{observation_id}')
-def get_observation_resource_by_id(observation_id: str, response: Response):
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+async def get_observation_resource_by_id(observation_id: str, response: Response, passthrough: bool = False):
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_observation_resource_by_id(observation_id)
+    fhir_client_response = await fhir_client.get_observation_resource_by_id(observation_id, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -423,29 +652,20 @@ class ObservationResourceModel(BaseModel):
     json_payload: str
 
 # Create POST method API to create composition resource
-@app.post('/api/CreateObservation')
-def create_observation_resource(observation_resource_model: ObservationResourceModel, response: Response):
-    post_data = observation_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
-        response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+@app.post('/api/CreateObservation', openapi_extra=fhir_payload_openapi(ObservationResourceModel))
+async def create_observation_resource(request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_observation_resource(json_payload.encode('utf-8'))
+    fhir_client_response = await fhir_client.upload_observation_resource(fhir_payload['payload'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
     return loads(fhir_client_response.text)
 
@@ -453,31 +673,123 @@ class BundleResourceModel(BaseModel):
     json_payload: str
 
 # Create POST method API to create immunization or observation bundle resource
-@app.post('/api/CreateBundle/{bundle_name}')
-def create_bundle_resource(bundle_name, bundle_resource_model: BundleResourceModel, response: Response):
-    post_data = bundle_resource_model.dict()
-    json_payload = b64decode(post_data['json_payload']).decode('utf-8')
-    if check_json_field(post_data, 'json_payload') is False:
+@app.post('/api/CreateBundle/{bundle_name}', openapi_extra=fhir_payload_openapi(BundleResourceModel))
+async def create_bundle_resource(bundle_name, request: Request, response: Response, passthrough: bool = False):
+    fhir_payload = await read_fhir_payload(request, 'json_payload is missed.')
+    if 'error' in fhir_payload:
+        response.status_code = fhir_payload['status_code']
+        return {'error': fhir_payload['error']}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return {'error': 'json_payload is missed.'}
-    check_result = check_json_str(json_payload)
-    if check_result is not True:
-        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
+        return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
+    fhir_client_response = await fhir_client.upload_bundle_resource(fhir_payload['payload'], bundle_name, stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
+    response.status_code = fhir_client_response.status_code
+    return loads(fhir_client_response.text)
 
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
+# Create POST method API to ingest NDJSON resources of mixed types as transaction Bundles
+@app.post('/api/BulkIngest')
+async def bulk_ingest(request: Request, response: Response, bundle_size: int = 100, concurrency: int = 4):
+    if bundle_size < 1 or bundle_size > 1000 or concurrency < 1 or concurrency > 32:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'bundle_size should be between 1 and 1000 and concurrency should be between 1 and 32.'}
 
-    if fhir_server is False:
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
 
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.upload_bundle_resource(json_payload.encode('utf-8'), bundle_name)
-    response.status_code = fhir_client_response.status_code
-    return loads(fhir_client_response.text)
+    # Waiting for a free slot before reading further keeps the upload back-pressured to the upstream pace
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+    bundle_tasks = []
+    bundle_lines = []
+    line_number = 0
+    try:
+        async for line in iterate_ndjson_lines(request.stream()):
+            line_number += 1
+            if line.strip() == b'':
+                continue
+            try:
+                resource = loads(line)
+            except ValueError:
+                results.append({'line': line_number, 'error': 'line is not a valid JSON.'})
+                continue
+            if isinstance(resource, dict) is False or 'resourceType' not in resource:
+                results.append({'line': line_number, 'error': 'resourceType field is missed.'})
+                continue
+
+            bundle_lines.append((line_number, resource))
+            if len(bundle_lines) >= bundle_size:
+                await semaphore.acquire()
+                bundle_tasks.append(asyncio.ensure_future(submit_transaction_lines(fhir_client, bundle_lines, semaphore)))
+                bundle_lines = []
+
+        if len(bundle_lines) > 0:
+            await semaphore.acquire()
+            bundle_tasks.append(asyncio.ensure_future(submit_transaction_lines(fhir_client, bundle_lines, semaphore)))
+
+        for bundle_results in await asyncio.gather(*bundle_tasks):
+            results.extend(bundle_results)
+    finally:
+        # A failed upload or a client disconnect must not leave the other Bundles running unawaited
+        for bundle_task in bundle_tasks:
+            bundle_task.cancel()
+    results.sort(key=lambda result: result['line'])
+    failed = len([result for result in results if 'error' in result])
+
+    return {
+        'total': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results,
+    }
+
+# FHIR relative reference to one resource, such as Patient/123
+fhir_reference_pattern = re.compile(r'^[A-Z][A-Za-z]+/[A-Za-z0-9\-\.]{1,64}$')
+
+class BatchReadModel(BaseModel):
+    references: List[str]
+    use_batch_bundle: Optional[bool] = None
+    concurrency: int = 10
+
+# Create POST method API to read many resources by ResourceType/id references at once
+@app.post('/api/BatchRead')
+async def batch_read(batch_read_model: BatchReadModel, response: Response):
+    post_data = batch_read_model.dict()
+    if len(post_data['references']) == 0 or len(post_data['references']) > 100:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'references field should have between 1 and 100 items.'}
+    if post_data['concurrency'] < 1 or post_data['concurrency'] > 50:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'concurrency field value should be between 1 and 50.'}
+
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
+
+    references = [reference for reference in post_data['references'] if fhir_reference_pattern.match(reference)]
+    use_batch_bundle = post_data['use_batch_bundle']
+    if use_batch_bundle is None:
+        use_batch_bundle = await fhir_client.check_batch_support()
+
+    if use_batch_bundle is True:
+        read_results = await read_references_by_batch_bundle(fhir_client, references)
+    else:
+        read_results = await read_references_concurrently(fhir_client, references, post_data['concurrency'])
+
+    results = []
+    for reference in post_data['references']:
+        if reference in read_results:
+            results.append(dict({'reference': reference}, **read_results[reference]))
+        else:
+            results.append({'reference': reference, 'status': status.HTTP_400_BAD_REQUEST, 'error': 'reference should be ResourceType/id.'})
+
+    return {'batch_bundle': use_batch_bundle, 'results': results}
 
 # Create POST method API to query Immunization bundle:
 '''
@@ -486,50 +798,85 @@ def create_bundle_resource(bundle_name, bundle_resource_model: BundleResourceMod
 3. By organization id and date
 '''
 @app.post('/api/SearchImmunization')
-def query_immunization_resource(search_params_model: FHIRServerSearchParamsModel, response: Response):
+async def query_immunization_resource(search_params_model: FHIRServerSearchParamsModel, response: Response, passthrough: bool = False):
     post_data = search_params_model.dict()
     if check_json_field(post_data, 'search_params') is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'search_params field is missed.'}
 
-    fhir_server_info = get_fhir_server_setting()
-    fhir_server = fhir_server_info[0]
-    fhir_token = fhir_server_info[1]
-    is_required_auth = fhir_token_existence(fhir_token)
-
-    if fhir_server is False:
+    fhir_client = get_fhir_client()
+    if fhir_client is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'Bad Request, FHIR Server setting is not found. Please use /api/fhir_server API firstly.'}
-
-    fhir_client = Client(fhir_server, is_required_auth, fhir_token)
-    fhir_client_response = fhir_client.get_immunization_resource_by_search(post_data['search_params'])
+    fhir_client_response = await fhir_client.get_immunization_resource_by_search(post_data['search_params'], stream=passthrough)
+    if passthrough is True:
+        return passthrough_response(fhir_client_response)
     response.status_code = fhir_client_response.status_code
 
     return loads(fhir_client_response.text)
 
-# Create GET method API to read hospital list CSV file and get hospital list JSON
+# Cache-Control header of the hospital list, clients revalidate it with the ETag afterwards
+hospital_lists_cache_control = 'public, max-age=' + getenv('HOSPITAL_LIST_MAX_AGE', '3600')
+
+# Create GET method API to get the hospital list JSON preloaded from hospital list CSV file
 @app.get('/api/GetHospitalLists')
-def get_hospital_lists():
-    file_handler = open('./hospital.csv', 'r')
-    line_of_contents = file_handler.readline()
-    line_of_contents = file_handler.readline()
-    response_json = {
-        'hospital_name': [],
-        'hospital_number': [],
+async def get_hospital_lists(if_none_match: Optional[str] = Header(None)):
+    registry = get_hospital_registry()
+    headers = {
+        'ETag': registry.hospital_lists_etag,
+        'Cache-Control': hospital_lists_cache_control,
     }
-    while line_of_contents != '':
-        line_of_contents = line_of_contents[0:-1].split(',')
-        response_json['hospital_number'].append(line_of_contents[0])
-        response_json['hospital_name'].append(line_of_contents[1])
-        line_of_contents = file_handler.readline()
-
-    file_handler.close()
+    if registry.etag_matches(if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(content=registry.hospital_lists_body, media_type='application/json', headers=headers)
+
+class HospitalSearchModel(BaseModel):
+    county_code: List[str] = []
+    service_items: List[str] = []
+    departments: List[str] = []
+    contract_type: List[str] = []
+    facility_type: List[str] = []
+    match: str = 'all'
+    page: int = 1
+    page_size: int = 20
+
+# Create POST method API to search the preloaded hospital list by county, service item, department and contract type
+@app.post('/api/SearchHospital')
+async def search_hospital(hospital_search_model: HospitalSearchModel, response: Response):
+    post_data = hospital_search_model.dict()
+    if post_data['match'] not in ['all', 'any']:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'match field value should be all or any.'}
+    if post_data['page'] < 1 or post_data['page_size'] < 1 or post_data['page_size'] > 100:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'page should be positive and page_size should be between 1 and 100.'}
+
+    filters = {
+        'county_code': post_data['county_code'],
+        'service_items': post_data['service_items'],
+        'departments': post_data['departments'],
+        'contract_type': post_data['contract_type'],
+        'facility_type': post_data['facility_type'],
+    }
+    offset = (post_data['page'] - 1) * post_data['page_size']
+    total, hospitals = get_hospital_registry().search(filters, post_data['match'] == 'all', offset, post_data['page_size'])
 
-    return response_json
+    # Returning the response directly skips the jsonable_encoder pass over the locally built body
+    return FastJSONResponse({
+        'total': total,
+        'page': post_data['page'],
+        'page_size': post_data['page_size'],
+        'hospitals': [hospital._asdict() for hospital in hospitals],
+    })
 
 class RequestRecordModel(BaseModel):
     identifier_number: str
     ip_address: str
+    output: str = 'json'
+    box_size: int = 10
+    border: int = 4
+    error_correction: str = 'M'
 
 # Create POST method API to query Database by specific hashed identifier number
 @app.post('/api/GetDatabaseRecord')
@@ -538,6 +885,10 @@ def get_database_record(request_record_model: RequestRecordModel, response: Resp
     if check_json_field(post_data, 'identifier_number') is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'identifier_number field is missed.'}
+    check_result = check_qr_code_options(post_data)
+    if check_result is not True:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return check_result
     hashed_identifier_number = sha3_384_hash(post_data['identifier_number'])
     query_result = query_database_by_hashed_identified_number(hashed_identifier_number)
     if query_result is False:
@@ -545,20 +896,25 @@ def get_database_record(request_record_model: RequestRecordModel, response: Resp
         return {'error': 'cannot find immunization record'}
 
     if check_expired_token(query_result[3]) is True:
+        qr_code_cache.evict_token(query_result[4])
         query_result = list(query_result)
         query_result[3] = int(datetime.now().timestamp())
         random.seed()
         query_result[4] = sha3_384_hash(str(random.random()) + str(query_result[3]))
         store_fhir_passport_token(query_result)
 
-    return {
+    image = generate_qr_code_image(post_data, query_result[4])
+    if post_data['output'] != 'json':
+        return Response(content=image, media_type=image_media_types[post_data['output']])
+
+    return FastJSONResponse({
         'DoseNumberPositiveInt': query_result[0],
         'lastOccurrenceDate': query_result[1],
         'hashedIdentifierNumber': query_result[2],
         'createdTokenDateTime': query_result[3],
         'Token': query_result[4],
-        'base64EncodedImage': generate_qr_code_image(post_data['ip_address'], query_result[4]),
-    }
+        'base64EncodedImage': b64encode(image),
+    })
 
 class InsertPassportTokenModel(BaseModel):
     dose_number_positive_int: int
@@ -602,22 +958,87 @@ def generate_qr_code(request_payload_model: RequestRecordModel, response: Respon
     if check_json_field(post_data, 'identifier_number') is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'identifier_number field is missed.'}
+    check_result = check_qr_code_options(post_data)
+    if check_result is not True:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return check_result
 
     hashed_identifier_number = sha3_384_hash(post_data['identifier_number'])
     query_result = query_database_by_hashed_identified_number(hashed_identifier_number)
 
-    if len(query_result) == 0:
+    if query_result is False:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'no record found by this identifier number on this table.'}
 
-    return {
+    image = generate_qr_code_image(post_data, query_result[4])
+    if post_data['output'] != 'json':
+        return Response(content=image, media_type=image_media_types[post_data['output']])
+
+    return FastJSONResponse({
         'dose_number_positive_int': query_result[0],
         'last_occurrence_date': query_result[1],
         'hashed_identifier_number': query_result[2],
         'created_token_date_time': query_result[3],
         'token': query_result[4],
-        'base64_encoded_image': generate_qr_code_image(post_data['ip_address'], query_result[4]),
-    }
+        'base64_encoded_image': b64encode(image),
+    })
+
+# Create GET method API to expose Prometheus metrics summed over every worker process
+@app.get('/metrics')
+def get_metrics():
+    return Response(content=generate_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+# Create GET method API to list the request profiles stored on disk
+@app.get('/api/Profiles')
+def get_profiles(response: Response, x_profile: Optional[str] = Header(None)):
+    if is_admin_token(x_profile) is False:
+        response.status_code = status.HTTP_403_FORBIDDEN
+        return {'error': 'X-Profile header should carry the profiling admin token.'}
+
+    return {'profiles': list_profiles()}
+
+# Create GET method API to download one request profile as folded stacks for a flamegraph or as a speedscope file
+@app.get('/api/Profiles/{profile_id}')
+def get_profile(profile_id: str, response: Response, output: str = 'speedscope', x_profile: Optional[str] = Header(None)):
+    if is_admin_token(x_profile) is False:
+        response.status_code = status.HTTP_403_FORBIDDEN
+        return {'error': 'X-Profile header should carry the profiling admin token.'}
+    if output not in ['speedscope', 'flamegraph']:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'error': 'output field value should be speedscope or flamegraph.'}
+
+    profile = load_profile(profile_id)
+    if profile is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {'error': 'no profile found by this profile_id.'}
+
+    if output == 'flamegraph':
+        return Response(content=to_collapsed_stacks(profile), media_type='text/plain')
+    return Response(
+        content=dumps(to_speedscope(profile)),
+        media_type='application/json',
+        headers={'Content-Disposition': 'attachment; filename="' + profile_id + '.speedscope.json"'},
+    )
+
+# Create GET method API to get the circuit breaker state of every upstream server called by this worker
+@app.get('/api/UpstreamStatus')
+async def get_upstream_status():
+    return {'upstreams': circuit_breaker_stats()}
+
+# Create GET method API to get QR code image cache counters of this worker
+@app.get('/api/QRCodeCacheStats')
+async def get_qr_code_cache_stats():
+    return qr_code_cache.stats()
+
+# Create GET method API to get FHIR resource read cache counters of this worker
+@app.get('/api/FHIRCacheStats')
+async def get_fhir_cache_stats():
+    return resource_cache.stats()
+
+# Create GET method API to get pruned and remaining row counts of the latest retention sweep of this worker
+@app.get('/api/RetentionStats')
+async def get_retention_stats():
+    return retention_report
 
 class TokenPayloadModel(BaseModel):
     token: str
@@ -630,7 +1051,7 @@ def validate_qr_code(token_payload_model: TokenPayloadModel, response: Response)
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'token field is missed.'}
 
-    query_result = query_database_by_token(post_data['token'])
+    query_result = query_passport_token(post_data['token'])
 
     if query_result is False:
         response.status_code = status.HTTP_410_GONE
@@ -640,9 +1061,9 @@ def validate_qr_code(token_payload_model: TokenPayloadModel, response: Response)
         response.status_code = status.HTTP_410_GONE
         return {'error': 'Token is expired.'}
 
-    return {
+    return FastJSONResponse({
         'validation_result': 'Success',
-    }
+    })
 
 class VaccineRegisterModel(BaseModel):
     vaccinePersonName: str
@@ -666,48 +1087,66 @@ def register_vaccine(vaccine_register_model: VaccineRegisterModel, response: Res
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'error': 'doseInputList field is missed.'}
 
-    dose_json_str = b64decode(post_data['doseInputList']).decode('utf-8')
-    check_result = check_json_str(dose_json_str)
-    if check_result is not True:
+    vaccine_register = build_vaccine_register(post_data)
+    if vaccine_register is False:
         response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
-        return check_result
-
-    dose_list_id = token_hex()
-    hashed_identity_number = sha3_384_hash(post_data['identityNumber'])
-    user_info = [
-        post_data['vaccinePersonName'],
-        post_data['vaccinePersonEnFirstName'],
-        post_data['vaccinePersonEnLastName'],
-        post_data['countryName'],
-        hashed_identity_number,
-        dose_list_id,
-    ]
-    fetched_result = query_vaccine_register_exists(hashed_identity_number)
-    if fetched_result is not False:
-        dose_list_id = fetched_result[0]
-
-    vaccine_record = []
-    dose_json_obj = loads(dose_json_str)
-    for dose_list in dose_json_obj:
-        vaccine_record.append([
-            dose_list['doseManufactureName'],
-            dose_list['doseNumber'],
-            dose_list['vaccinateDateStr'],
-            dose_list_id,
-        ])
+        return {'error': 'json_payload filed value is invalid'}
 
-    store_vaccine_register(user_info, vaccine_record, fetched_result)
+    store_vaccine_registers([vaccine_register])
 
     return {'result': '成功註冊疫苗紀錄！'}
 
+class BulkVaccineRegisterModel(BaseModel):
+    vaccineRegisterList: List[VaccineRegisterModel]
+
+# Create POST method API to create many vaccine register lists in one transaction
+@app.post('/api/RegisterVaccineBulk')
+def register_vaccine_bulk(bulk_vaccine_register_model: BulkVaccineRegisterModel, response: Response):
+    post_data = bulk_vaccine_register_model.dict()
+    vaccine_registers = []
+    for index, register_data in enumerate(post_data['vaccineRegisterList']):
+        vaccine_register = build_vaccine_register(register_data)
+        if vaccine_register is False:
+            response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+            return {'error': 'json_payload filed value is invalid', 'index': index}
+        vaccine_registers.append(vaccine_register)
+
+    store_vaccine_registers(vaccine_registers)
+
+    return {'result': '成功註冊疫苗紀錄！', 'count': len(vaccine_registers)}
+
+class QueryVerifyResultModel(BaseModel):
+    token: str
+
 # Create POST method API to query verified result from TWID Portal
 @app.post('/api/QueryVerifyResult')
-def query_verified_result():
-    return {}
+def query_verified_result(query_verify_result_model: QueryVerifyResultModel, response: Response):
+    post_data = query_verify_result_model.dict()
+    verify_outcome = query_verify_outcome(post_data['token'])
+    if verify_outcome is False:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {'error': 'The token is not found.'}
+
+    return {
+        'VerifyNo': verify_outcome[0],
+        'MemberNo': verify_outcome[1],
+        'Token': post_data['token'],
+        'DoReturnCode': verify_outcome[2],
+        'DoResultCode': verify_outcome[3],
+        'QueryStatus': verify_outcome[4],
+        'QueryAttempts': verify_outcome[5],
+        'QueryReturnCode': verify_outcome[6],
+        'QueryResultCode': verify_outcome[7],
+        'QueryTime': verify_outcome[8],
+        'QueryError': verify_outcome[9],
+    }
+
+# TWID Portal endpoint queried for the verified result
+twca_query_verify_result_url = getenv('TWCA_QUERY_VERIFY_RESULT_URL', 'https://midonlinetest.twca.com.tw/IDPortal/QueryVerifyResult')
 
 # Create POST method API to get verified result from TWID Portal
 @app.post('/TWCA-api/api/VerifyResult')
-def verify_result(
+async def verify_result(
         BusinessNo: str = Form(...),
         ApiVersion: str = Form(...),
         HashKeyNo: str = Form(...),
@@ -720,33 +1159,7 @@ def verify_result(
         ReturnCodeDesc: str = Form(...),
         IdentifyNo: str = Form(...),
     ):
-    update_do_verify_no(Token, ReturnCode, ResultCode)
-    member_no = query_member_no_by_token(Token)
-    if member_no is False:
-        return {
-            'Error': 'QueryVerifyResult is failed to find member no.',
-        }
-
-    member_no = member_no[0]
-    portal_server = 'https://midonlinetest.twca.com.tw/IDPortal/QueryVerifyResult'
-    twca_config = get_twca_config()
-    plain_text = BusinessNo + ApiVersion + HashKeyNo + VerifyNo + member_no + Token + twca_config['hash_key']
-    identify_no = identify_generator(plain_text)
-    twca_client = TWCAClient(portal_server)
-    payload = {
-        'BusinessNo': BusinessNo,
-        'ApiVersion': ApiVersion,
-        'HashKeyNo': HashKeyNo,
-        'VerifyNo': VerifyNo,
-        'MemberNo': member_no,
-        'Token': Token,
-        'IdentifyNo': identify_no,
-    }
-    query_verified_response = twca_client.query_verified_result(payload)
-    output_params = loads(query_verified_response['OutputParams'])
-    update_query_verify_no(Token, query_verified_response['ReturnCode'], query_verified_response['ResultCode'], output_params['VerifyTime'])
-
-    return {
+    callback_form = {
         'BusinessNo': BusinessNo,
         'ApiVersion': ApiVersion,
         'HashKeyNo': HashKeyNo,
@@ -759,6 +1172,16 @@ def verify_result(
         'ReturnCodeDesc': ReturnCodeDesc,
         'IdentifyNo': IdentifyNo,
     }
+    # The portal is acknowledged once the callback is stored, QueryVerifyResult follows in a background worker
+    member_no = await asyncio.to_thread(store_verify_callback, Token, ReturnCode, ResultCode, callback_form)
+    if member_no is False:
+        return {
+            'Error': 'QueryVerifyResult is failed to find member no.',
+        }
+
+    verify_result_jobs['queue'].put_nowait((Token, member_no[0], callback_form))
+
+    return callback_form
 
 class LoginTWIDPortalModel(BaseModel):
     url: str
@@ -774,7 +1197,7 @@ class LoginTWIDPortalModel(BaseModel):
 
 # Create POST method API to login TWID Portal
 @app.post('/TWCA-api/api/LoginTWIDPortal')
-def login_twid_portal(login_twid_portal_model: LoginTWIDPortalModel, response: Response):
+async def login_twid_portal(login_twid_portal_model: LoginTWIDPortalModel, response: Response):
     twca_config = get_twca_config()
     if 'error' in twca_config.keys():
         response.status_code = status.HTTP_400_BAD_REQUEST
@@ -815,7 +1238,7 @@ def login_twid_portal(login_twid_portal_model: LoginTWIDPortalModel, response: R
         'InputParams': dumps(input_params),
     }
 
-    token_response = twca_client.login_portal(post_data['url'], payload)
+    token_response = await twca_client.login_portal(post_data['url'], payload)
     if token_response['ReturnCode'] != '0':
         return token_response
 
@@ -827,25 +1250,260 @@ def login_twid_portal(login_twid_portal_model: LoginTWIDPortalModel, response: R
     login_result_code = token_response['ResultCode']
     login_return_code = token_response['ReturnCode']
     login_time = output_params['TimeStamp']
-    store_verify_no(verify_no, token_response['IdentifyNo'], token, member_no, login_result_code, login_return_code, login_time)
+    await asyncio.to_thread(store_verify_no, verify_no, token_response['IdentifyNo'], token, member_no, login_result_code, login_return_code, login_time)
 
     return token_response
 
-def generate_qr_code_image(ip_address, hashed_token):
-    validation_url = ip_address + '/validate?token=' + hashed_token
-    image = qrcode.make(validation_url)
-    output_binary = BytesIO()
-    image.save(output_binary, format='PNG')
+def generate_qr_code_image(post_data, hashed_token):
+    validation_url = post_data['ip_address'] + '/validate?token=' + hashed_token
+    # The JSON output embeds the base64 encoded PNG image
+    image_format = 'png' if post_data['output'] == 'json' else post_data['output']
+
+    started_at = perf_counter()
+    image = get_qr_code_image(
+        validation_url,
+        hashed_token,
+        image_format,
+        post_data['box_size'],
+        post_data['border'],
+        post_data['error_correction'],
+    )
+    qr_code_image_duration_seconds.labels(image_format).observe(perf_counter() - started_at)
+
+    return image
+
+def check_qr_code_options(post_data):
+    if post_data['output'] not in ['json', 'png', 'svg']:
+        return {'error': 'output field value should be json, png or svg.'}
+    if post_data['box_size'] < 1 or post_data['box_size'] > 50:
+        return {'error': 'box_size field value should be between 1 and 50.'}
+    if post_data['border'] < 0 or post_data['border'] > 20:
+        return {'error': 'border field value should be between 0 and 20.'}
+    if post_data['error_correction'] not in error_correction_levels:
+        return {'error': 'error_correction field value should be L, M, Q or H.'}
+
+    return True
+
+def build_vaccine_register(post_data):
+    dose_json_str = b64decode(post_data['doseInputList']).decode('utf-8')
+    if check_json_str(dose_json_str) is not True:
+        return False
+
+    user_info = [
+        post_data['vaccinePersonName'],
+        post_data['vaccinePersonEnFirstName'],
+        post_data['vaccinePersonEnLastName'],
+        post_data['countryName'],
+        sha3_384_hash(post_data['identityNumber']),
+        token_hex(),
+    ]
+    dose_records = []
+    for dose_list in loads(dose_json_str):
+        dose_records.append([
+            dose_list['doseManufactureName'],
+            dose_list['doseNumber'],
+            dose_list['vaccinateDateStr'],
+        ])
 
-    return b64encode(output_binary.getvalue())
+    return user_info, dose_records
+
+def passthrough_response(fhir_client_response):
+    # Forward the raw upstream bytes without decoding, parsing or re-encoding them
+    if fhir_client_response.is_stream_consumed is True:
+        # Responses served by the resource cache are already read and decoded
+        headers = {}
+        for header_name in ['etag', 'last-modified', 'location']:
+            if header_name in fhir_client_response.headers:
+                headers[header_name] = fhir_client_response.headers[header_name]
+
+        return Response(
+            content=fhir_client_response.content,
+            status_code=fhir_client_response.status_code,
+            headers=headers,
+            media_type=fhir_client_response.headers.get('content-type', 'application/fhir+json'),
+        )
+
+    headers = {}
+    for header_name in ['content-encoding', 'content-length', 'etag', 'last-modified', 'location']:
+        if header_name in fhir_client_response.headers:
+            headers[header_name] = fhir_client_response.headers[header_name]
+
+    return StreamingResponse(
+        stream_fhir_response(fhir_client_response),
+        status_code=fhir_client_response.status_code,
+        headers=headers,
+        media_type=fhir_client_response.headers.get('content-type', 'application/fhir+json'),
+    )
+
+async def stream_fhir_response(fhir_client_response):
+    try:
+        async for chunk in fhir_client_response.aiter_raw():
+            yield chunk
+    finally:
+        await fhir_client_response.aclose()
+
+async def stream_bundle_entries(fhir_client, fhir_client_response, max_entries=None):
+    # Only the current page and the prefetched next page are held in memory
+    sent_entries = 0
+    next_page = None
+    try:
+        while fhir_client_response is not None:
+            if fhir_client_response.status_code != 200:
+                yield dumps({'error': 'Bundle page request is failed.', 'status_code': fhir_client_response.status_code}) + '\n'
+                break
+
+            bundle = loads(fhir_client_response.content)
+            entries = bundle.get('entry', [])
+            next_url = get_bundle_link(bundle, 'next')
+            if next_url is not None and (max_entries is None or sent_entries + len(entries) < max_entries):
+                next_page = asyncio.ensure_future(fhir_client.get_bundle_page(next_url))
+
+            for entry in entries:
+                if max_entries is not None and sent_entries >= max_entries:
+                    break
+                yield dumps(entry.get('resource', entry), ensure_ascii=False) + '\n'
+                sent_entries += 1
+
+            fhir_client_response = None
+            if next_page is not None:
+                fhir_client_response = await next_page
+                next_page = None
+    except (httpx.HTTPError, UpstreamUnavailableError) as error:
+        next_page = None
+        yield dumps({'error': 'Bundle page request is failed: ' + str(error), 'status_code': upstream_error_status(error)}) + '\n'
+    except ValueError as error:
+        yield dumps({'error': str(error)}) + '\n'
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+def get_bundle_link(bundle, relation):
+    for link in bundle.get('link', []):
+        if link.get('relation') == relation:
+            return link.get('url')
+
+    return None
+
+async def iterate_ndjson_lines(byte_stream):
+    buffered = b''
+    async for chunk in byte_stream:
+        buffered += chunk
+        lines = buffered.split(b'\n')
+        buffered = lines.pop()
+        for line in lines:
+            yield line
+
+    if buffered != b'':
+        yield buffered
+
+def upstream_error_status(error):
+    # Timeouts, refused connections and open circuit breakers are 503, any other failed exchange is 502
+    if isinstance(error, UpstreamUnavailableError):
+        return status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return status.HTTP_502_BAD_GATEWAY
+
+async def submit_transaction_lines(fhir_client, bundle_lines, semaphore):
+    try:
+        entries = []
+        for line_number, resource in bundle_lines:
+            # Resources carrying an id are upserted, the others are created with a server assigned id
+            if 'id' in resource:
+                request_entry = {'method': 'PUT', 'url': resource['resourceType'] + '/' + str(resource['id'])}
+            else:
+                request_entry = {'method': 'POST', 'url': resource['resourceType']}
+            entries.append({'fullUrl': 'urn:uuid:' + str(uuid4()), 'resource': resource, 'request': request_entry})
+        bundle = {'resourceType': 'Bundle', 'type': 'transaction', 'entry': entries}
+
+        try:
+            fhir_client_response = await fhir_client.upload_transaction_bundle(dumps(bundle, ensure_ascii=False).encode('utf-8'))
+        except (httpx.HTTPError, UpstreamUnavailableError) as error:
+            return [
+                {'line': line_number, 'error': 'FHIR server request is failed: ' + str(error), 'status_code': upstream_error_status(error)}
+                for line_number, resource in bundle_lines
+            ]
+
+        if fhir_client_response.status_code != 200:
+            return [
+                {'line': line_number, 'error': 'transaction Bundle is rejected.', 'status_code': fhir_client_response.status_code}
+                for line_number, resource in bundle_lines
+            ]
+
+        # transaction-response entries follow the order of the submitted entries
+        response_entries = loads(fhir_client_response.content).get('entry', [])
+        results = []
+        for index, (line_number, resource) in enumerate(bundle_lines):
+            entry_response = response_entries[index].get('response', {}) if index < len(response_entries) else {}
+            results.append({
+                'line': line_number,
+                'status': entry_response.get('status'),
+                'location': entry_response.get('location'),
+            })
+
+        return results
+    finally:
+        semaphore.release()
+
+async def read_references_concurrently(fhir_client, references, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read_reference(reference):
+        async with semaphore:
+            try:
+                fhir_client_response = await fhir_client.get_resource_by_reference(reference)
+            except (httpx.HTTPError, UpstreamUnavailableError) as error:
+                return reference, {'status': upstream_error_status(error), 'error': 'FHIR server request is failed: ' + str(error)}
+
+        try:
+            return reference, {'status': fhir_client_response.status_code, 'resource': loads(fhir_client_response.content)}
+        except ValueError:
+            return reference, {'status': fhir_client_response.status_code, 'error': 'FHIR server response is not a valid JSON.'}
+
+    # Duplicated references are only read once
+    read_tasks = [asyncio.ensure_future(read_reference(reference)) for reference in dict.fromkeys(references)]
+    try:
+        return dict(await asyncio.gather(*read_tasks))
+    finally:
+        for read_task in read_tasks:
+            read_task.cancel()
+
+async def read_references_by_batch_bundle(fhir_client, references):
+    references = list(dict.fromkeys(references))
+    bundle = {
+        'resourceType': 'Bundle',
+        'type': 'batch',
+        'entry': [{'request': {'method': 'GET', 'url': reference}} for reference in references],
+    }
+    try:
+        fhir_client_response = await fhir_client.upload_transaction_bundle(dumps(bundle).encode('utf-8'), 'batch')
+    except (httpx.HTTPError, UpstreamUnavailableError) as error:
+        return {reference: {'status': upstream_error_status(error), 'error': 'FHIR server request is failed: ' + str(error)} for reference in references}
+
+    if fhir_client_response.status_code != 200:
+        return {reference: {'status': fhir_client_response.status_code, 'error': 'batch Bundle is rejected.'} for reference in references}
+
+    # batch-response entries follow the order of the submitted entries
+    response_entries = loads(fhir_client_response.content).get('entry', [])
+    read_results = {}
+    for index, reference in enumerate(references):
+        entry = response_entries[index] if index < len(response_entries) else {}
+        entry_status = str(entry.get('response', {}).get('status', '502')).split(' ')[0]
+        read_result = {'status': int(entry_status) if entry_status.isdigit() else status.HTTP_502_BAD_GATEWAY}
+        if 'resource' in entry:
+            read_result['resource'] = entry['resource']
+        elif 'outcome' in entry.get('response', {}):
+            read_result['resource'] = entry['response']['outcome']
+        read_results[reference] = read_result
+
+    return read_results
 
 def check_expired_token(created_token_time):
-    return (int(datetime.now().timestamp()) - int(created_token_time)) > 180
+    return (int(datetime.now().timestamp()) - int(created_token_time)) > TOKEN_EXPIRY_SECONDS
 
 def check_fhir_server_status(fhir_server):
     try:
-        requests.get(fhir_server)
-    except ValueError:
+        requests.get(fhir_server, timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+    except (ValueError, requests.RequestException):
         return False
 
     return True
@@ -858,215 +1516,83 @@ def check_json_str(json_payload):
 
     return True
 
-def check_json_field(post_data, key_name):
-    return key_name in list(post_data.keys())
-
-def create_vaccine_register_table():
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        CREATE TABLE IF NOT EXISTS "vaccine_register"(
-            [RegisterId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            [VaccinePersonName] NVARCHAR(100) NOT NULL,
-            [VaccinePersonFirstName] NVARCHAR(100) NULL,
-            [VaccinePersonLastName] NVARCHAR(100) NULL,
-            [CountryName] NVARCHAR(100) NULL,
-            [IdentityNumber] NVARCHAR(100) NOT NULL,
-            [DoseListId] NVARCHAR(100) NOT NULL
-        )
-    ''')
-    db_conn.commit()
-
-    db_conn.execute('''
-        CREATE TABLE IF NOT EXISTS "vaccine_dose_lists"(
-            [ListId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            [DoseManufactureName] NVARCHAR(50) NOT NULL,
-            [DoseNumber] INT NOT NULL,
-            [VaccineDate] NVARCHAR(50) NOT NULL,
-            [DoseListId] NVARCHAR(100) NOT NULL,
-            CONSTRAINT fk_dose_list_id
-                FOREIGN KEY (DoseListId)
-                REFERENCES vaccine_register(DoseListId)
-        )
-    ''')
-    db_conn.commit()
-    db_conn.close()
-    return True
-
-def create_fhir_server_table():
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        CREATE TABLE IF NOT EXISTS "fhir_server"(
-            [ServerId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            [Server] NVARCHAR(100) NOT NULL,
-            [Token] NVARCHAR(100) NULL
-        )
-    ''')
-    db_conn.commit()
-    db_conn.close()
-    return True
-
-def create_fhir_passport_table():
-    db_conn = sqlite3.connect(gettempdir() + '/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        CREATE TABLE IF NOT EXISTS "passport_token"(
-            [PassportId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            [DoseNumberPositiveInt] TINYINT NOT NULL,
-            [lastOccurrenceDate] NVARCHAR(15) NOT NULL,
-            [hashedIdentifierNumber] NVARCHAR(150) NOT NULL,
-            [createdTokenDateTime] INT NOT NULL,
-            [Token] NVARCHAR(200) NULL
-        )
-    ''')
-    db_conn.commit()
-    db_conn.close()
-    return True
-
-def store_fhir_passport_token(record):
-    create_fhir_passport_table()
-    db_conn = sqlite3.connect(gettempdir() + '/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute(
-        '''
-            DELETE FROM passport_token WHERE hashedIdentifierNumber = ?
-        ''',
-        [record[2]]
-    )
-    db_conn.execute(
-        '''
-        INSERT INTO passport_token
-        (
-            DoseNumberPositiveInt,
-            lastOccurrenceDate,
-            hashedIdentifierNumber,
-            createdTokenDateTime,
-            Token
-        )
-        VALUES (?, ?, ?, ?, ?)
-        ''',
-        record
-    )
-    db_conn.commit()
-    db_conn.close()
-    return True
-
-def store_fhir_server_setting(fhir_server, fhir_token=None):
-    create_fhir_server_table()
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-
-    db_conn.execute('DELETE FROM fhir_server')
-    db_conn.commit()
-
-    if fhir_token is None:
-        db_conn.execute('INSERT INTO fhir_server(Server) VALUES (?)', [fhir_server])
+async def read_fhir_payload(request, missed_error):
+    # A raw application/fhir+json body is forwarded as it is, otherwise json_payload carries the base64 encoded resource
+    body = await request.body()
+    if request.headers.get('content-type', '').split(';')[0].strip().lower() == 'application/fhir+json':
+        post_data = dict(request.query_params)
+        payload = body
     else:
-        db_conn.execute('INSERT INTO fhir_server(Server, Token) VALUES (?, ?)', [fhir_server, fhir_token])
-    db_conn.commit()
-    db_conn.close()
-    return True
+        try:
+            post_data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return {'status_code': status.HTTP_422_UNPROCESSABLE_ENTITY, 'error': 'request body is not a valid JSON.'}
+        if isinstance(post_data, dict) is False or check_json_field(post_data, 'json_payload') is False or isinstance(post_data['json_payload'], str) is False:
+            return {'status_code': status.HTTP_400_BAD_REQUEST, 'error': missed_error}
+        try:
+            payload = b64decode(post_data['json_payload'])
+        except ValueError:
+            return {'status_code': status.HTTP_422_UNPROCESSABLE_ENTITY, 'error': 'json_payload filed value is invalid'}
+
+    # The resource is parsed once to validate it and never serialized again
+    try:
+        resource = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        return {'status_code': status.HTTP_422_UNPROCESSABLE_ENTITY, 'error': 'json_payload filed value is invalid'}
 
-def query_vaccine_register_exists(identity_number):
-    create_vaccine_register_table()
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-    fetched_obj = db_conn.execute('''
-        SELECT DoseListId FROM vaccine_register WHERE
-        IdentityNumber = ?
-    ''', [identity_number])
-    fetched_result = fetched_obj.fetchone()
-    db_conn.close()
-
-    if fetched_result is None:
-        return False
+    return {
+        'payload': payload,
+        'post_data': post_data,
+        'resource': resource,
+    }
 
-    return fetched_result
-
-def store_vaccine_register(user_info, vaccine_records, fetched_result):
-    create_vaccine_register_table()
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-    if fetched_result is False:
-        db_conn.execute('''
-            INSERT INTO vaccine_register(
-                VaccinePersonName,
-                VaccinePersonFirstName,
-                VaccinePersonLastName,
-                CountryName,
-                IdentityNumber,
-                DoseListId
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        ''', user_info)
-        db_conn.commit()
-
-    for vaccine_record in vaccine_records:
-        db_conn.execute('''
-            INSERT INTO vaccine_dose_lists(
-                DoseManufactureName, DoseNumber, VaccineDate, DoseListId
-            ) VALUES (?, ?, ?, ?)
-        ''', vaccine_record)
-        db_conn.commit()
-
-    db_conn.close()
-    return True
+def check_json_field(post_data, key_name):
+    return key_name in list(post_data.keys())
 
-def query_database_by_token(token):
-    create_fhir_passport_table()
-    db_conn = sqlite3.connect(gettempdir() + '/healthy_passport.sqlite3')
-    db_conn.cursor()
-    fetched_obj = db_conn.execute(
-        '''
-        SELECT
-            DoseNumberPositiveInt,
-            lastOccurrenceDate,
-            hashedIdentifierNumber,
-            createdTokenDateTime,
-            Token
-        FROM passport_token WHERE Token=? ORDER BY PassportId DESC LIMIT 1
-        ''', [token])
-    fetched_result = fetched_obj.fetchone()
-    db_conn.close()
-
-    if fetched_result is None:
-        return False
+# Cached FHIR server setting and derived client of this worker process
+fhir_server_cache = {
+    'pid': None,
+    'data_version': None,
+    'setting': False,
+    'client': False,
+}
+fhir_server_refresh_lock = Lock()
+
+def refresh_fhir_server_cache(force=False):
+    # Called from threads only, PRAGMA data_version waits for the database lock and changes whenever another worker commits
+    with fhir_server_refresh_lock:
+        data_version = hospital_db.data_version()
+        if force is False and fhir_server_cache['pid'] == getpid() and fhir_server_cache['data_version'] == data_version:
+            return False
+
+        # Other tables share hospital_db, so the client and its batch support are only rebuilt when the setting row changed
+        fhir_server_info = query_fhir_server_setting()
+        if fhir_server_cache['pid'] == getpid() and fhir_server_cache['setting'] == fhir_server_info:
+            fhir_server_cache['data_version'] = data_version
+            return False
+
+        fhir_client = False
+        if fhir_server_info is not False:
+            fhir_client = AsyncClient(fhir_server_info[0], fhir_token_existence(fhir_server_info[1]), fhir_server_info[1])
+        fhir_server_cache['setting'] = fhir_server_info
+        fhir_server_cache['client'] = fhir_client
+        fhir_server_cache['data_version'] = data_version
+        fhir_server_cache['pid'] = getpid()
+
+        return True
 
-    return fetched_result
-
-def query_database_by_hashed_identified_number(hashed_identifier_number):
-    create_fhir_passport_table()
-    db_conn = sqlite3.connect(gettempdir() + '/healthy_passport.sqlite3')
-    db_conn.cursor()
-    fetched_obj = db_conn.execute(
-        '''
-        SELECT
-            DoseNumberPositiveInt,
-            lastOccurrenceDate,
-            hashedIdentifierNumber,
-            createdTokenDateTime,
-            Token
-        FROM passport_token WHERE hashedIdentifierNumber=? ORDER BY PassportId DESC LIMIT 1
-        ''', [hashed_identifier_number])
-    fetched_result = fetched_obj.fetchone()
-    db_conn.close()
-
-    if fetched_result is None:
-        return False
+def get_fhir_server_setting():
+    # Requests only read memory, the lifespan loads the setting and keeps it fresh in the background
+    if fhir_server_cache['pid'] != getpid():
+        refresh_fhir_server_cache()
 
-    return fetched_result
+    return fhir_server_cache['setting']
 
-def get_fhir_server_setting():
-    create_fhir_server_table()
-    db_conn = sqlite3.connect(gettempdir() + '/hospital_system_server.sqlite3')
-    db_conn.cursor()
-    fetched_obj = db_conn.execute('SELECT Server,Token FROM fhir_server ORDER BY ServerId DESC LIMIT 1')
-    fetched_result = fetched_obj.fetchone()
-    db_conn.close()
-
-    if fetched_result is None:
-        return False
-    return fetched_result
+def get_fhir_client():
+    if fhir_server_cache['pid'] != getpid():
+        refresh_fhir_server_cache()
+
+    return fhir_server_cache['client']
 
 def fhir_token_existence(fhir_token):
     return fhir_token is not None
@@ -1096,106 +1622,6 @@ def get_twca_config():
 def get_verify_no():
     return str(uuid4()).replace('-', '')
 
-def update_do_verify_no(login_token, do_return_code, do_result_code):
-    create_verify_no()
-    db_conn = sqlite3.connect('/var/tmp/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        UPDATE twid_verify_no
-        SET DoReturnCode = ?, DoResultCode = ?
-        WHERE LoginToken = ?
-    ''', [do_return_code, do_result_code, login_token])
-    db_conn.commit()
-    db_conn.close()
-
-    return True
-
-def update_query_verify_no(login_token, query_return_code, query_result_code, query_time):
-    create_verify_no()
-    db_conn = sqlite3.connect('/var/tmp/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        UPDATE twid_verify_no
-        SET QueryReturnCode = ?, QueryResultCode = ?, QueryTime= ?
-        WHERE LoginToken = ?
-    ''', [query_return_code, query_result_code, query_time, login_token])
-    db_conn.commit()
-    db_conn.close()
-
-    return True
-
-def query_member_no_by_token(token):
-    db_conn = sqlite3.connect('/var/tmp/healthy_passport.sqlite3')
-    db_conn.cursor()
-    fetched_obj = db_conn.execute('''
-        SELECT MemberNo FROM twid_verify_no
-        WHERE LoginToken = ?
-    ''', [token])
-    fetched_result = fetched_obj.fetchone()
-    db_conn.close()
-
-    if fetched_result is None:
-        return False
-
-    return fetched_result
-
-def store_verify_no(verify_no, identify_no, login_token, member_no, login_result_code, login_return_code, login_time):
-    create_verify_no()
-    created_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    db_conn = sqlite3.connect('/var/tmp/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        INSERT INTO twid_verify_no(
-            VerifyNo,
-            MemberNo,
-            LoginToken,
-            IdentifyNoWithToken,
-            CreatedDateTime,
-            LoginResultCode,
-            LoginReturnCode,
-            LoginTime
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', [
-        verify_no,
-        member_no,
-        login_token,
-        identify_no,
-        created_time,
-        login_result_code,
-        login_return_code,
-        login_time
-    ])
-    db_conn.commit()
-    db_conn.close()
-
-    return True
-
-def create_verify_no():
-    db_conn = sqlite3.connect('/var/tmp/healthy_passport.sqlite3')
-    db_conn.cursor()
-    db_conn.execute('''
-        CREATE TABLE IF NOT EXISTS "twid_verify_no"(
-            [ListId] INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            [VerifyNo] NVARCHAR(70) NOT NULL,
-            [MemberNo] NVARCHAR(70) NOT NULL,
-            [LoginToken] NVARCHAR(100) NOT NULL,
-            [IdentifyNoWithToken] NVARCHAR(150) NOT NULL,
-            [CreatedDateTime] NVARCHAR(50) NOT NULL,
-            [LoginResultCode] NVARCHAR(5) NOT NULL,
-            [LoginReturnCode] NVARCHAR(10) NOT NULL,
-            [LoginTime] NVARCHAR(70) NOT NULL,
-            [DoResultCode] NVARCHAR(5) NULL,
-            [DoReturnCode] NVARCHAR(10) NULL,
-            [QueryResultCode] NVARCHAR(5) NULL,
-            [QueryReturnCode] NVARCHAR(10) NULL,
-            [QueryTime] NVARCHAR(70) NULL
-        )
-    ''')
-    db_conn.commit()
-    db_conn.close()
-
-    return True
-
 def identify_generator(plain_text):
     encoded = plain_text.encode('utf-16le')
     hashed = sha256(encoded)
@@ -8,8 +8,8 @@ setup(name='hospital-system-server',
       url='https://gitlab.com/iii-api-platform/hospital-system-server',
       author='peter279k',
       author_email='peter279k@gmail.com',
-      packages=['FHIRClient', 'TWCAClient'],
+      packages=['FHIRClient', 'TWCAClient', 'Storage', 'HospitalList', 'QRCodeRenderer', 'Monitoring', 'Upstream'],
       license='MIT',
-      python_requires=">=3.7",
+      python_requires=">=3.9",
       zip_safe=False)
 
@@ -0,0 +1,27 @@
+# Import pytest module
+import pytest
+
+# Import databases list and query plan checker
+from Storage.Database import databases, close_databases, explain_query_plans
+
+
+@pytest.fixture
+def temporary_databases(tmp_path, monkeypatch):
+    # Every database is migrated from scratch in tmp_path instead of touching the server's files
+    close_databases()
+    for index, database in enumerate(databases):
+        monkeypatch.setattr(database, 'path', str(tmp_path / ('database_%d.sqlite3' % index)))
+    yield databases
+    close_databases()
+
+
+def test_lookup_queries_use_indexes(temporary_databases):
+    assert explain_query_plans() == []
+
+
+def test_query_plan_checker_reports_table_scans(temporary_databases, monkeypatch):
+    monkeypatch.setattr('Storage.Database.lookup_queries', [
+        (temporary_databases[0], 'SELECT * FROM vaccine_register WHERE CountryName = ?'),
+    ])
+
+    assert len(explain_query_plans()) == 1